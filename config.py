@@ -20,10 +20,18 @@ class Config:
     MATTERMOST_CONNECT_RETRY_DELAY = int(
         os.getenv("MATTERMOST_CONNECT_RETRY_DELAY", "2")
     )
+    # Как часто HTTP polling перечитывает список DM каналов бота (сек)
+    MATTERMOST_CHANNELS_REFRESH_INTERVAL = int(
+        os.getenv("MATTERMOST_CHANNELS_REFRESH_INTERVAL", "60")
+    )
 
     # Jira настройки (только URL, учетные данные индивидуальные)
     JIRA_URL = os.getenv("JIRA_URL")
     JIRA_REQUEST_TIMEOUT = int(os.getenv("JIRA_REQUEST_TIMEOUT", "20"))
+    # Размер страницы поиска задач; сервер может ограничить его своим максимумом
+    JIRA_SEARCH_PAGE_SIZE = int(os.getenv("JIRA_SEARCH_PAGE_SIZE", "1000"))
+    # Сколько задач с неполным списком worklog догружать одновременно
+    JIRA_WORKLOG_FETCH_WORKERS = int(os.getenv("JIRA_WORKLOG_FETCH_WORKERS", "5"))
 
     # Настройки бота
     BOT_NAME = os.getenv("BOT_NAME", "jira-timesheet-bot")
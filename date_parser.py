@@ -5,7 +5,8 @@
 """
 
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 from typing import Tuple, Optional
 import calendar
 
@@ -53,9 +54,16 @@ class DateParser:
         "дек": 12,
     }
 
+    # Размер кэша распознанных периодов
+    PARSE_CACHE_SIZE = 512
+
     def __init__(self):
-        # Убираем кеширование даты - будем вычислять при каждом запросе
-        pass
+        # Текущую дату не кешируем - она вычисляется при каждом запросе.
+        # Результаты разбора кешируются по (текст, дата), поэтому относительные
+        # периоды вроде "эта неделя" пересчитываются со сменой дня
+        self._parse_cached = lru_cache(maxsize=self.PARSE_CACHE_SIZE)(
+            self._parse_normalized
+        )
 
     @property
     def today(self):
@@ -74,8 +82,12 @@ class DateParser:
             Даты в формате YYYY-MM-DD или None при ошибке
             explanation - объяснение что было распознано
         """
-        text = text.lower().strip()
+        return self._parse_cached(text.lower().strip(), self.today.date())
 
+    def _parse_normalized(
+        self, text: str, day: date
+    ) -> Tuple[Optional[str], Optional[str], str]:
+        """Разбор уже нормализованного текста; day участвует только в ключе кэша"""
         # Удаляем лишние слова
         text = re.sub(
             r"\b(за|в|на|с|по|до|период|времени?|отчет|отчёт)\b", "", text
@@ -1,6 +1,6 @@
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
-from typing import List, Dict, Optional
+from typing import BinaryIO, List, Dict, Optional
 import logging
 from datetime import datetime
 import io
@@ -44,66 +44,85 @@ class ExcelGenerator:
         Returns:
             Байты Excel файла
         """
+        excel_buffer = io.BytesIO()
+        self.write_timesheet_report(
+            excel_buffer, worklogs, project_name, start_date, end_date, projects
+        )
+        return excel_buffer.getvalue()
+
+    def write_timesheet_report(
+        self,
+        output: BinaryIO,
+        worklogs: List[Dict],
+        project_name: str,
+        start_date: str,
+        end_date: str,
+        projects: Optional[List[Dict]] = None,
+    ) -> None:
+        """
+        Записать Excel отчет с трудозатратами в бинарный файл
+
+        Позволяет сохранить отчет сразу во временный файл на диске, не держа
+        в памяти вторую копию книги в виде bytes.
+
+        Args:
+            output: Файл (или буфер), открытый на запись в бинарном режиме
+            worklogs, project_name, start_date, end_date, projects:
+                как у generate_timesheet_report
+        """
         try:
-            # Создаем новую книгу
-            wb = Workbook()
-            ws = wb.active
-            if ws is None:
-                raise ValueError("Не удалось создать рабочий лист")
-            ws.title = f"Трудозатраты {project_name}"
-
-            # Добавляем строку заголовков (первая строка) начиная с колонки A
-            ws.cell(row=1, column=1, value="Дата работы")  # A1
-            ws.cell(row=1, column=2, value="Исполнитель")  # B1
-            ws.cell(row=1, column=3, value="Часы")  # C1
-            ws.cell(row=1, column=4, value="Содержание работы")  # D1
-            ws.cell(row=1, column=5, value="Проектная задача")  # E1
-            ws.cell(row=1, column=6, value="Проект")  # F1
-            ws.cell(row=1, column=7, value="Задача в Jira")  # G1
-
-            # Заполняем данными начиная со второй строки
-            for row, worklog in enumerate(worklogs, 2):  # Начинаем со второй строки
-                # Парсим дату из строки и записываем как текст в формате DD.MM.YYYY HH:MM:SS
+            # Книга в режиме write_only: строки сразу сериализуются и не хранятся
+            # в памяти как объекты ячеек, поэтому память не растет с размером отчета
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet(f"Трудозатраты {project_name}")
+
+            # Ширину столбцов в режиме write_only задаем до записи строк
+            for col in range(1, 8):  # A-G
+                column_letter = get_column_letter(col)
+                ws.column_dimensions[column_letter].width = self._get_column_width(col)
+
+            # Строка заголовков (первая строка) начиная с колонки A
+            ws.append(
+                [
+                    "Дата работы",  # A
+                    "Исполнитель",  # B
+                    "Часы",  # C
+                    "Содержание работы",  # D
+                    "Проектная задача",  # E
+                    "Проект",  # F
+                    "Задача в Jira",  # G
+                ]
+            )
+
+            # Данные начиная со второй строки. Формат ячеек "Общий" (по умолчанию)
+            for worklog in worklogs:
+                # Дату записываем как текст в формате DD.MM.YYYY HH:MM:SS
                 try:
-                    # Парсим дату в формате "2025-6-18 14:30"
+                    # Парсим дату в формате "2025-06-18 14:30"
                     date_obj = datetime.strptime(worklog["date"], "%Y-%m-%d %H:%M")
                     # Форматируем как текст в российском формате
                     formatted_date = date_obj.strftime("%d.%m.%Y %H:%M:%S")
-                    date_cell = ws.cell(row=row, column=1, value=formatted_date)
-                    # Явно устанавливаем формат ячейки как "Общий" (текст)
-                    date_cell.number_format = "General"
                 except ValueError:
                     # Если не удалось распарсить, записываем как есть
-                    date_cell = ws.cell(row=row, column=1, value=worklog["date"])
-                    date_cell.number_format = "General"
-
-                ws.cell(row=row, column=2, value=worklog["executor"])  # B - Исполнитель
-                ws.cell(row=row, column=3, value=worklog["hours"])  # C - Часы
-                ws.cell(
-                    row=row, column=4, value=worklog["description"]
-                )  # D - Содержание работы
-                ws.cell(
-                    row=row, column=5, value=worklog["project_task"]
-                )  # E - Проектная задача
-                ws.cell(row=row, column=6, value=worklog["project"])  # F - Проект
-                ws.cell(
-                    row=row, column=7, value=worklog["task_summary"]
-                )  # G - Задача в Jira
-
-            # Автоширина столбцов
-            for col in range(1, 8):  # A-G
-                column_letter = get_column_letter(col)
-                ws.column_dimensions[column_letter].width = self._get_column_width(col)
-
-            # Сохраняем в память
-            excel_buffer = io.BytesIO()
-            wb.save(excel_buffer)
-            excel_buffer.seek(0)
+                    formatted_date = worklog["date"]
+
+                ws.append(
+                    [
+                        formatted_date,  # A - Дата работы
+                        worklog["executor"],  # B - Исполнитель
+                        worklog["hours"],  # C - Часы
+                        worklog["description"],  # D - Содержание работы
+                        worklog["project_task"],  # E - Проектная задача
+                        worklog["project"],  # F - Проект
+                        worklog["task_summary"],  # G - Задача в Jira
+                    ]
+                )
+
+            wb.save(output)
 
             logger.info(
                 f"Сгенерирован Excel отчет по шаблону с заголовками и {len(worklogs)} записями"
             )
-            return excel_buffer.getvalue()
 
         except Exception as e:
             logger.error(f"Ошибка генерации Excel отчета: {e}")
@@ -1,9 +1,12 @@
 from jira import JIRA
 from jira.exceptions import JIRAError
+from jira.resources import Issue
 from datetime import datetime
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal, ROUND_HALF_UP
 from requests.exceptions import Timeout, ConnectionError as RequestsConnectionError
 from config import Config
@@ -14,6 +17,12 @@ logger = logging.getLogger(__name__)
 class JiraClient:
     """Клиент для работы с Jira API с индивидуальными учетными данными"""
 
+    # Время жизни кэша списка проектов (сек): список меняется редко
+    PROJECTS_CACHE_TTL = 300
+
+    # Поля задачи, которые используются при построении отчета
+    SEARCH_FIELDS = ("summary", "project", "worklog")
+
     def __init__(self, username: str = None, password: str = None):
         """
         Инициализация клиента Jira с индивидуальными учетными данными
@@ -23,6 +32,8 @@ class JiraClient:
             password: Пароль пользователя для Jira
         """
         self.jira = None
+        # (список проектов, time.monotonic() на момент загрузки)
+        self._projects_cache: Optional[tuple] = None
         if username and password:
             self._connect(username, password)
 
@@ -32,6 +43,11 @@ class JiraClient:
         timeout = Config.JIRA_REQUEST_TIMEOUT
         return (timeout, timeout)
 
+    @staticmethod
+    def _search_batch_sizes() -> dict:
+        """Размер страницы поиска задач для search_issues(maxResults=False)."""
+        return {Issue: Config.JIRA_SEARCH_PAGE_SIZE}
+
     def _connect(self, username: str, password: str):
         """Подключение к Jira с указанными учетными данными"""
         try:
@@ -39,6 +55,7 @@ class JiraClient:
                 server=Config.JIRA_URL,
                 basic_auth=(username, password),
                 timeout=self._request_timeout(),
+                default_batch_sizes=self._search_batch_sizes(),
             )
             logger.info(f"Успешно подключились к Jira для пользователя {username}")
         except Exception as e:
@@ -57,9 +74,13 @@ class JiraClient:
                 server=Config.JIRA_URL,
                 basic_auth=(username, password),
                 timeout=self._request_timeout(),
+                default_batch_sizes=self._search_batch_sizes(),
             )
             user = test_jira.current_user()
             logger.info(f"Тестовое подключение к Jira успешно для: {user}")
+            # Проверенное подключение сохраняем, чтобы клиентом можно было
+            # пользоваться без повторной аутентификации
+            self.jira = test_jira
             return True, f"Успешно! Подключен как: {user}"
         except Timeout:
             timeout_sec = Config.JIRA_REQUEST_TIMEOUT
@@ -87,14 +108,21 @@ class JiraClient:
             return False, error_msg
 
     def get_projects(self) -> List[Dict]:
-        """Получить список доступных проектов"""
+        """Получить список доступных проектов (кэшируется на PROJECTS_CACHE_TTL)"""
         if not self.jira:
             logger.error("Jira клиент не инициализирован")
             return []
 
+        cached = self._projects_cache
+        if cached and time.monotonic() - cached[1] < self.PROJECTS_CACHE_TTL:
+            return cached[0]
+
         try:
-            projects = self.jira.projects()
-            return [{"key": p.key, "name": p.name} for p in projects]
+            projects = [{"key": p.key, "name": p.name} for p in self.jira.projects()]
+            # Пустой список означает отсутствие доступа — не кэшируем
+            if projects:
+                self._projects_cache = (projects, time.monotonic())
+            return projects
         except Exception as e:
             logger.error(f"Ошибка получения списка проектов: {e}")
             return []
@@ -113,21 +141,52 @@ class JiraClient:
         Returns:
             Список словарей с данными о трудозатратах
         """
+        return self.get_worklogs_for_projects([project_key], start_date, end_date)
+
+    def get_worklogs_for_projects(
+        self, project_keys: List[str], start_date: str, end_date: str
+    ) -> List[Dict]:
+        """
+        Получить трудозатраты по нескольким проектам за период одним поиском
+
+        Args:
+            project_keys: Ключи проектов в Jira
+            start_date: Дата начала в формате YYYY-MM-DD
+            end_date: Дата окончания в формате YYYY-MM-DD
+
+        Returns:
+            Список словарей с данными о трудозатратах всех проектов;
+            ключ "project_key" указывает проект записи
+        """
         if not self.jira:
             logger.error("Jira клиент не инициализирован")
             return []
 
+        if not project_keys:
+            return []
+
+        keys_text = ", ".join(project_keys)
         try:
-            # JQL запрос для поиска задач проекта с worklog в указанном периоде
-            jql = f'project = {project_key} AND worklogDate >= "{start_date}" AND worklogDate <= "{end_date}"'
+            # Один JQL запрос на все проекты вместо отдельного поиска по каждому
+            projects_jql = ", ".join(f'"{key}"' for key in project_keys)
+            jql = f'project in ({projects_jql}) AND worklogDate >= "{start_date}" AND worklogDate <= "{end_date}"'
 
-            issues = self.jira.search_issues(jql, expand="worklog", maxResults=1000)
+            # maxResults=False - библиотека забирает все страницы размером
+            # JIRA_SEARCH_PAGE_SIZE, а если сервер отдает меньше (свой лимит),
+            # продолжает с фактическим размером страницы. Раньше результат
+            # молча обрезался на первой странице
+            # Запрашиваем только нужные поля: описание задачи целиком (все поля
+            # по умолчанию) многократно увеличивает ответ Jira. Библиотека
+            # переписывает список полей на месте, поэтому передаем копию
+            issues = self.jira.search_issues(
+                jql, fields=list(self.SEARCH_FIELDS), maxResults=False
+            )
 
             worklogs_data = []
 
-            for issue in issues:
-                # Получаем все worklog для задачи
-                worklogs = self.jira.worklogs(issue.key)
+            # Получаем все worklog для задач
+            for issue, worklogs in zip(issues, self._issues_worklogs(issues)):
+                project_key = issue.fields.project.key
 
                 for worklog in worklogs:
                     # Проверяем что worklog попадает в наш период
@@ -183,9 +242,11 @@ class JiraClient:
                         )
 
                         # Формируем описание работы в формате "Номер задачи - Тема задачи: Состав работ"
-                        if worklog.comment:
+                        # У worklog без комментария поля comment может не быть
+                        comment = getattr(worklog, "comment", None)
+                        if comment:
                             ticket_description = (
-                                f"{issue.key} - {issue_summary}: {worklog.comment}"
+                                f"{issue.key} - {issue_summary}: {comment}"
                             )
                         else:
                             ticket_description = f"{issue.key} - {issue_summary}"
@@ -214,21 +275,26 @@ class JiraClient:
                                 project_task_value = f"Сопровождение {month_name}"
 
                         worklog_data = {
-                            "date": worklog_date.strftime("%Y-%-m-%-d %H:%M"),
+                            # С ведущими нулями, чтобы строки сортировались по дате
+                            "date": worklog_date.strftime("%Y-%m-%d %H:%M"),
                             "executor": author_name,
                             "hours": hours_str.replace(
                                 ".", ","
                             ),  # Заменяем точку на запятую для Excel
+                            # Те же часы числом - для подсчета итогов без
+                            # повторного разбора строки
+                            "hours_value": float(hours_decimal),
                             "description": ticket_description,
                             "project_task": project_task_value,
                             "task_summary": issue_summary,  # Тема задачи в отдельном столбце
                             "project": issue.fields.project.name,
+                            "project_key": project_key,
                         }
 
                         worklogs_data.append(worklog_data)
 
             logger.info(
-                f"Найдено {len(worklogs_data)} записей трудозатрат для проекта {project_key}"
+                f"Найдено {len(worklogs_data)} записей трудозатрат для проектов {keys_text}"
             )
             return worklogs_data
 
@@ -236,6 +302,40 @@ class JiraClient:
             logger.error(f"Ошибка получения трудозатрат: {e}")
             return []
 
+    def _issues_worklogs(self, issues) -> list:
+        """Worklog каждой задачи: из ответа поиска, если он там полный, иначе запросом.
+
+        Поиск возвращает в поле worklog только первые записи (обычно до 20);
+        отдельный запрос нужен лишь задачам, у которых записей больше. Такие
+        запросы выполняются параллельно, не более JIRA_WORKLOG_FETCH_WORKERS
+        одновременно. Порядок результата совпадает с порядком задач.
+        """
+        results = [self._inline_worklogs(issue) for issue in issues]
+        missing = [index for index, worklogs in enumerate(results) if worklogs is None]
+        if not missing:
+            return results
+
+        workers = min(len(missing), max(1, Config.JIRA_WORKLOG_FETCH_WORKERS))
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="jira-worklogs"
+        ) as executor:
+            fetched = executor.map(
+                lambda index: self.jira.worklogs(issues[index].key), missing
+            )
+            for index, worklogs in zip(missing, fetched):
+                results[index] = worklogs
+        return results
+
+    @staticmethod
+    def _inline_worklogs(issue) -> Optional[list]:
+        """Worklog из ответа поиска или None, если там не все записи задачи"""
+        worklog_field = getattr(issue.fields, "worklog", None)
+        if worklog_field is not None:
+            inline_worklogs = getattr(worklog_field, "worklogs", None) or []
+            if getattr(worklog_field, "total", 0) <= len(inline_worklogs):
+                return inline_worklogs
+        return None
+
     def test_current_connection(self) -> bool:
         """Проверить текущее соединение с Jira"""
         if not self.jira:
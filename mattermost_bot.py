@@ -1,26 +1,246 @@
 from mattermostdriver import Driver
+from mattermostdriver.exceptions import NotEnoughPermissions, ResourceNotFound
 import asyncio
 import logging
 import json
+import re
 import ssl
-from datetime import datetime
-from typing import Dict
+import tempfile
+from datetime import date
+from typing import TYPE_CHECKING, BinaryIO, Dict, Optional, Set, Tuple
 from config import Config
-from jira_client import JiraClient
-from excel_generator import ExcelGenerator
-from user_auth import UserAuthManager
+from user_auth import UserAuthManager, UserSession
 from date_parser import DateParser
 import time
+from collections import defaultdict
+from dataclasses import replace
+from operator import itemgetter
 import urllib3
 import requests as _requests_mod
 from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from threading import Event
+from urllib.parse import urlparse
+from functools import cached_property
+
+if TYPE_CHECKING:
+    from jira_client import JiraClient
+
+try:
+    # orjson разбирает события WebSocket в 2-3 раза быстрее стандартного json
+    import orjson
+
+    _loads = orjson.loads
+except ImportError:  # orjson не установлен - используем стандартный json
+    _loads = json.loads
 
 # Отключаем SSL предупреждения для production среды
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# Ключевые слова команд, сгруппированные по тегу команды
+_COMMAND_KEYWORDS = {
+    "help": frozenset({"помощь", "help", "команды"}),
+    "auth": frozenset({"настройка", "подключение", "авторизация"}),
+    "projects": frozenset({"проекты", "список проектов"}),
+    "report": frozenset({"отчет", "трудозатраты"}),
+    "reset": frozenset({"сброс", "очистить"}),
+}
+
+_KEYWORD_TAGS = {
+    keyword: tag for tag, keywords in _COMMAND_KEYWORDS.items() for keyword in keywords
+}
+
+# Одно регулярное выражение со всеми ключевыми словами: сообщение просматривается
+# за один проход независимо от количества команд. Длинные слова идут первыми,
+# чтобы при общем префиксе выигрывало более длинное совпадение.
+_COMMAND_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(_KEYWORD_TAGS, key=len, reverse=True))
+)
+
+# Готовые результаты для сообщений, состоящих ровно из одного ключевого слова
+_EXACT_COMMAND_TAGS = {
+    keyword: frozenset({tag}) for keyword, tag in _KEYWORD_TAGS.items()
+}
+
+
+# Обработчики команд в порядке приоритета: (тег, метод бота, заголовок для лога).
+# Все обработчики принимают (channel_id, user_id).
+_COMMAND_DISPATCH = (
+    ("help", "send_help_sync", "🔍 Команда 'помощь'"),
+    ("auth", "start_jira_auth_sync", "🔐 Команда 'настройка'"),
+    ("projects", "send_projects_list_sync", "📋 Команда 'проекты'"),
+    ("report", "start_report_generation_sync", "📊 Команда 'отчет'"),
+    ("reset", "reset_user_auth_sync", "🗑️ Команда 'сброс'"),
+)
+
+
+def _match_commands(message_lower: str) -> frozenset:
+    """Теги всех команд, ключевые слова которых встречаются в сообщении"""
+    # Чаще всего команда приходит одним словом - обходимся поиском в словаре
+    exact = _EXACT_COMMAND_TAGS.get(message_lower)
+    if exact is not None:
+        return exact
+    return frozenset(
+        _KEYWORD_TAGS[m.group(0)] for m in _COMMAND_RE.finditer(message_lower)
+    )
+
+
+# Дата в формате YYYY-MM-DD (месяц и день допускаются из одной цифры, как в strptime)
+_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+
+
+# Неизменяемые тексты сообщений собираем один раз при импорте модуля
+HELP_TEXT = """
+**Бот для выгрузки трудозатрат из Jira** 📊
+
+**Первый запуск:**
+• `настройка` - подключение к вашему аккаунту Jira
+
+**Доступные команды:**
+• `проекты` - показать список доступных проектов
+• `отчет` или `трудозатраты` - сгенерировать отчет по трудозатратам
+• `сброс` - очистить сохраненные данные авторизации
+• `помощь` - показать эту справку
+
+**Для генерации отчета:**
+1. Убедитесь, что вы подключены к Jira (`настройка`)
+2. Введите команду `отчет`
+3. Выберите один или несколько проектов:
+   • Один проект: `PROJ`
+   • Несколько проектов: `PROJ1, PROJ2, PROJ3`
+4. Укажите период (начальную и конечную дату)
+5. Получите Excel файл с трудозатратами
+
+**📅 Указание периода (в свободном формате):**
+• `прошлая неделя`, `эта неделя`
+• `прошлый квартал`, `этот квартал`
+• `2 квартал 2024`, `первый квартал`, `II квартал`
+• `прошлый месяц`, `этот месяц` 
+• `май`, `июнь 2024`
+• `с мая по июнь`
+• `с 15 мая по 20 июня`
+• `последние 7 дней`, `последние 2 недели`
+• `2024-01-01` (один день)
+• `с 2024-01-01 по 2024-01-31`
+
+**Безопасность:**
+• Каждый пользователь подключается под своим аккаунтом Jira
+• Доступны только те проекты, к которым у вас есть права
+• Учетные данные хранятся в зашифрованном виде
+
+**Дополнительные возможности:**
+• При выборе нескольких проектов создается сводный отчет
+• Данные сортируются по дате и включают статистику по каждому проекту
+• Поддерживается неограниченное количество проектов в одном отчете
+
+**📚 Полезные ссылки:**
+• Инструкция по загрузке эксель файла в КСУП - https://confluence.1solution.ru/x/ZgwgGQ
+"""
+
+AUTH_PROMPT = """
+🔐 **Настройка подключения к Jira**
+
+**Шаг 1 из 2:** Введите ваше имя пользователя для подключения к Jira
+
+**Пример:** john.doe или john_doe
+"""
+
+RESET_CONFIRM = """
+🗑️ **Данные авторизации очищены**
+
+Ваши учетные данные Jira удалены из системы.
+
+Для повторного подключения введите команду `настройка`.
+"""
+
+AUTH_REQUIRED_TEXT = (
+    "❌ **Требуется подключение к Jira**\n\n"
+    "Введите команду `настройка` для подключения к вашему аккаунту Jira."
+)
+
+REPORT_PROMPT = (
+    "📋 **Генерация отчета по трудозатратам**\n\n"
+    "Введите ключ проекта или несколько ключей через запятую:\n"
+    "• Один проект: `PROJ`\n"
+    "• Несколько проектов: `PROJ1, PROJ2, PROJ3`\n"
+    "• Введите `проекты` для просмотра списка доступных проектов"
+)
+
+DATE_HELP = """
+**Примеры периодов:**
+• `прошлая неделя` или `эта неделя`
+• `прошлый квартал` или `этот квартал`
+• `2 квартал 2024` или `первый квартал`
+• `прошлый месяц` или `этот месяц`  
+• `май` или `июнь 2024`
+• `с мая по июнь`
+• `с 15 мая по 20 июня`
+• `последние 7 дней`
+• `последние 2 недели`
+• `2024-01-01` (один день)
+• `с 2024-01-01 по 2024-01-31`
+
+**Или стандартный формат:** YYYY-MM-DD"""
+
+DATE_RETRY_HELP = """
+**Попробуйте один из примеров:**
+• `прошлая неделя` - за прошлую неделю
+• `этот месяц` - текущий месяц
+• `май 2024` - май конкретного года  
+• `с мая по июнь` - период между месяцами
+• `последние 7 дней` - последняя неделя
+• `2024-01-01` - конкретный день
+• `с 2024-01-01 по 2024-01-31` - точный период"""
+
+WELCOME_TEXT = """
+🤖 **Добро пожаловать!**
+
+Я бот для выгрузки трудозатрат из Jira в Excel формат.
+
+**Для начала работы введите:** `настройка`
+
+**Или посмотрите справку:** `помощь`
+"""
+
+UNKNOWN_COMMAND_TEXT = """
+❓ **Не понимаю команду**
+
+**Попробуйте:**
+• `помощь` - список всех команд
+• `настройка` - подключение к Jira
+• `отчет` - создать отчет по трудозатратам
+
+**Для новых пользователей:** начните с команды `настройка`
+"""
+
+PASSWORD_PROMPT = """
+✅ **Имя пользователя сохранено**
+
+**Шаг 2 из 2:** Отправьте ваш пароль для Jira текстовым сообщением
+
+**Важно:** 
+- Используйте ваш обычный пароль от Jira
+- Пароль будет сохранен в зашифрованном виде
+- Никто не сможет увидеть ваш пароль в открытом виде
+- Просто напишите пароль в ответном сообщении
+"""
+
+NEXT_REPORT_HINT = """🔄 **Хотите создать новый отчёт?**
+
+**Быстрые команды:**
+• `отчет` - создать новый отчёт
+• `проекты` - посмотреть доступные проекты
+• `помощь` - полная справка по командам
+
+**💡 Совет:** Можете сразу написать `отчет` для быстрого создания нового отчёта!"""
+
+# Ограничение длины сообщения (лимит Mattermost ~16384 символа)
+MESSAGE_MAX_LENGTH = 15000
+TRUNCATION_NOTICE = "\n\n⚠️ **Сообщение обрезано из-за ограничений длины**"
+_TRUNCATED_BODY_LENGTH = MESSAGE_MAX_LENGTH - len(TRUNCATION_NOTICE)
+
 
 class _StandardSSLAdapter(HTTPAdapter):
     """HTTPAdapter, использующий стандартный SSL-контекст Python вместо
@@ -44,37 +264,69 @@ _mm_session.mount("https://", _StandardSSLAdapter())
 class MattermostBot:
     """Бот для Mattermost с интеграцией Jira"""
 
+    # Время жизни кэшей (сек)
+    USERNAME_CACHE_TTL = 300
+    JIRA_CLIENT_TTL = 600
+
+    # Размер отчета (байт), до которого временный файл хранится в памяти
+    REPORT_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
     def __init__(self):
         """Инициализация бота"""
         self._stop_event = Event()
+        # Будит цикл HTTP polling досрочно (например, при появлении нового DM)
+        self._poll_wake = Event()
         self._connected = False
 
         self.driver = self._create_driver()
-        self.excel_generator = ExcelGenerator()
         self.user_auth = (
             UserAuthManager()
         )  # Управление индивидуальными учетными данными
         self.date_parser = DateParser()  # Парсер дат в свободном формате
         self.loop = None  # Будет установлен в connect()
+        # Обработчики событий WebSocket выполняются в отдельном потоке по одному,
+        # чтобы долгие команды не блокировали event loop и heartbeat соединения
+        self._event_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="mm-events"
+        )
+        # Кэши с TTL: user_id -> (значение, time.monotonic() на момент загрузки)
+        self._username_cache: Dict[str, tuple] = {}
+        # Подключенные Jira клиенты пользователей (HTTP-сессия и keep-alive
+        # переиспользуются между командами): user_id -> (клиент, monotonic)
+        self._jira_clients: Dict[str, tuple] = {}
+        # Генерация и отправка отчетов (Jira + Excel + загрузка файла) занимает
+        # секунды, поэтому выполняется вне потока обработки сообщений
+        self._report_executor = ThreadPoolExecutor(
+            max_workers=4, thread_name_prefix="report"
+        )
+        # Команда бота определяется один раз (см. _get_team_id)
+        self._team_id: Optional[str] = None
+        # Тип канала не меняется, поэтому признак DM запоминаем навсегда
+        self._dm_type_cache: Dict[str, bool] = {}
+        # Пары (user_id, channel_id) с уже подтвержденным доступом к DM;
+        # сбрасываются при удалении бота из канала или ответе 403/404
+        self._dm_access_cache: Set[Tuple[str, str]] = set()
 
     def _create_driver(self) -> Driver:
         """Создание нового Mattermost Driver."""
-        # Правильная очистка URL от протокола
-        clean_url = Config.MATTERMOST_URL if Config.MATTERMOST_URL else ""
-        if clean_url.startswith("https://"):
-            clean_url = clean_url[8:]  # Удаляем 'https://'
-        elif clean_url.startswith("http://"):
-            clean_url = clean_url[7:]  # Удаляем 'http://'
+        # Из URL берем протокол, хост и порт: путь и завершающий слэш
+        # драйверу не нужны (адрес без схемы считаем https)
+        raw_url = Config.MATTERMOST_URL or ""
+        parsed = urlparse(raw_url if "://" in raw_url else f"https://{raw_url}")
+        clean_url = parsed.hostname or ""
+        scheme = parsed.scheme or "https"
 
         driver = Driver(
             {
                 "url": clean_url,
                 "token": Config.MATTERMOST_TOKEN,
-                "scheme": "https",
-                "port": 443,
+                "scheme": scheme,
+                "port": parsed.port or (80 if scheme == "http" else 443),
                 "basepath": "/api/v4",
                 "verify": Config.MATTERMOST_SSL_VERIFY,
                 "request_timeout": Config.MATTERMOST_REQUEST_TIMEOUT,
+                # Переподключаем WebSocket при обрыве вместо выхода из цикла
+                "keepalive": True,
                 "websocket_kw_args": {
                     "sslopt": (
                         {"cert_reqs": None} if not Config.MATTERMOST_SSL_VERIFY else {}
@@ -146,8 +398,8 @@ class MattermostBot:
         if Config.MATTERMOST_USE_WEBSOCKET:
             try:
                 logger.info("Запускаем WebSocket соединение...")
-                # Запускаем WebSocket синхронно
-                self.driver.init_websocket(event_handler=self.handle_event)
+                # Блокирует текущий поток до остановки WebSocket
+                self.driver.init_websocket(event_handler=self._handle_websocket_event)
                 logger.info("WebSocket соединение завершено")
             except Exception as e:
                 logger.error(f"Ошибка в WebSocket соединении: {e}")
@@ -157,27 +409,46 @@ class MattermostBot:
             logger.info("Запускаем HTTP polling режим (WebSocket отключен)...")
             self.start_http_polling()
 
+    async def _handle_websocket_event(self, message):
+        """Асинхронный обработчик сырых событий WebSocket.
+
+        mattermostdriver ожидает корутину и передает событие строкой JSON.
+        Событие разбирается здесь, а синхронная обработка ставится в очередь
+        потока обработчиков, чтобы не задерживать чтение WebSocket.
+        """
+        try:
+            event = _loads(message) if isinstance(message, str) else message
+            asyncio.get_running_loop().run_in_executor(
+                self._event_executor, self.handle_event, event
+            )
+        except Exception as e:
+            logger.error(f"Ошибка разбора события WebSocket: {e}")
+
     def start_http_polling(self):
         """HTTP polling для получения сообщений"""
         logger.info("Начинаем HTTP polling для получения сообщений...")
         logger.info("🔍 Бот готов к поиску новых DM каналов и сообщений")
 
-        last_check = int(time.time() * 1000)  # Миллисекунды
+        polling_started_at = int(time.time() * 1000)  # Миллисекунды
+        # Время создания последнего обработанного поста по каждому каналу
+        channel_cursors = {}
         dm_channels_cache = set()  # Кэш найденных DM каналов
         dm_channels = []
         last_channels_refresh = 0.0
-        channels_refresh_interval_sec = 60.0
+        channels_refresh_interval_sec = Config.MATTERMOST_CHANNELS_REFRESH_INTERVAL
 
-        team_id = Config.MATTERMOST_TEAM_ID
-        if not team_id:
+        if not Config.MATTERMOST_TEAM_ID:
             logger.warning(
                 "MATTERMOST_TEAM_ID не задан. Будет использовано автоопределение команды."
             )
 
+        # Посты DM каналов запрашиваются параллельно, а не по одному каналу за раз
+        poll_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mm-poll")
+
         while not self._stop_event.is_set():
             try:
                 current_time = int(time.time() * 1000)
-                logger.debug(f"Проверка новых сообщений в {current_time}")
+                logger.debug("Проверка новых сообщений в %d", current_time)
 
                 # Получаем все DM каналы, где участвует бот
                 try:
@@ -189,19 +460,11 @@ class MattermostBot:
                     )
 
                     if should_refresh_channels:
+                        team_id = self._get_team_id()
                         if not team_id:
-                            teams = self.driver.teams.get_user_teams(
-                                self.bot_user["id"]
-                            )
-                            if teams:
-                                team_id = teams[0]["id"]
-                                logger.info(
-                                    f"Автоматически определен team_id для polling: {team_id}"
-                                )
-                            else:
-                                logger.warning("Не найдено команд для пользователя")
-                                self._sleep_with_stop(5)
-                                continue
+                            logger.warning("Не найдено команд для пользователя")
+                            self._sleep_with_stop(5)
+                            continue
 
                         all_channels = self.driver.channels.get_channels_for_user(
                             self.bot_user["id"], team_id
@@ -210,6 +473,8 @@ class MattermostBot:
                         dm_channels = [
                             ch for ch in all_channels if ch.get("type") == "D"
                         ]
+                        for ch in all_channels:
+                            self._dm_type_cache[ch["id"]] = ch.get("type") == "D"
                         last_channels_refresh = now
 
                     # Логируем найденные каналы
@@ -218,45 +483,55 @@ class MattermostBot:
 
                     if new_channels:
                         logger.info(
-                            f"🆕 Обнаружено новых DM каналов: {len(new_channels)}"
+                            "🆕 Обнаружено новых DM каналов: %d", len(new_channels)
                         )
                         for channel_id in new_channels:
-                            logger.info(f"   Новый DM канал: {channel_id}")
+                            logger.info("   Новый DM канал: %s", channel_id)
                         dm_channels_cache.update(new_channels)
 
-                    logger.debug(f"Мониторим {len(dm_channels)} DM каналов...")
+                    logger.debug("Мониторим %d DM каналов...", len(dm_channels))
+
+                    # Запрашиваем посты всех DM каналов параллельно. Параметр since
+                    # отдает только посты, измененные после курсора канала
+                    futures = {
+                        channel["id"]: poll_executor.submit(
+                            self.driver.posts.get_posts_for_channel,
+                            channel["id"],
+                            params={
+                                "since": channel_cursors.get(
+                                    channel["id"], polling_started_at
+                                )
+                            },
+                        )
+                        for channel in dm_channels
+                    }
 
-                    # Проверяем каждый DM канал на новые сообщения
-                    for channel in dm_channels:
-                        channel_id = channel["id"]
+                    # Собираем новые сообщения всех DM каналов
+                    pending_posts = []
+                    for channel_id, future in futures.items():
+                        cursor = channel_cursors.get(channel_id, polling_started_at)
 
                         try:
-                            # Получаем последние посты в канале
-                            posts_response = self.driver.posts.get_posts_for_channel(
-                                channel_id
-                            )
+                            posts_response = future.result()
 
                             if posts_response and "posts" in posts_response:
+                                # since возвращает и отредактированные/удаленные
+                                # посты, поэтому оставляем только новые. order
+                                # отсортирован от новых к старым: идем до первого
+                                # поста не новее курсора
                                 posts = posts_response["posts"]
-
-                                for post_id, post in posts.items():
-                                    post_time = int(post["create_at"])
-
-                                    # Проверяем новые посты
-                                    if post_time > last_check:
-                                        user_id = post.get("user_id")
-                                        message = post.get("message", "")
-
-                                        # Игнорируем сообщения от бота
-                                        if user_id != self.bot_user["id"]:
-                                            logger.info(
-                                                f"🔥 НОВОЕ СООБЩЕНИЕ! От пользователя {user_id} в канале {channel_id}: '{message[:100]}{'...' if len(message) > 100 else ''}'"
-                                            )
-
-                                            # Обрабатываем команду
-                                            self.handle_message_sync(
-                                                message, channel_id, user_id
-                                            )
+                                new_posts = []
+                                for post_id in posts_response.get("order", ()):
+                                    post = posts[post_id]
+                                    if post["create_at"] <= cursor:
+                                        break
+                                    if not post.get("delete_at"):
+                                        new_posts.append(post)
+
+                                # Обрабатываем в хронологическом порядке
+                                pending_posts.extend(
+                                    (channel_id, post) for post in reversed(new_posts)
+                                )
 
                         except Exception as e:
                             # Проверяем на ошибку авторизации
@@ -276,14 +551,35 @@ class MattermostBot:
                                     )
                             else:
                                 logger.debug(
-                                    f"Ошибка проверки канала {channel_id}: {e}"
+                                    "Ошибка проверки канала %s: %s", channel_id, e
                                 )
 
-                    # Проверяем подключение к боту
-                    bot_info = self.driver.users.get_user(self.bot_user["id"])
-                    logger.debug(
-                        f"Статус бота: {bot_info.get('username', 'unknown')} - активен"
-                    )
+                    # Имена всех авторов новых сообщений — одним запросом
+                    author_ids = {
+                        post.get("user_id")
+                        for _, post in pending_posts
+                        if post.get("user_id") != self.bot_user["id"]
+                    }
+                    if author_ids:
+                        try:
+                            self._resolve_usernames(author_ids)
+                        except Exception as e:
+                            logger.debug("Не удалось получить имена авторов: %s", e)
+
+                    for channel_id, post in pending_posts:
+                        channel_cursors[channel_id] = int(post["create_at"])
+                        user_id = post.get("user_id")
+                        message = post.get("message", "")
+
+                        # Игнорируем сообщения от бота
+                        if user_id != self.bot_user["id"]:
+                            if logger.isEnabledFor(logging.INFO):
+                                logger.info(
+                                    f"🔥 НОВОЕ СООБЩЕНИЕ! От пользователя {user_id} в канале {channel_id}: '{message[:100]}{'...' if len(message) > 100 else ''}'"
+                                )
+
+                            # Обрабатываем команду
+                            self.handle_message_sync(message, channel_id, user_id)
 
                 except Exception as e:
                     # Проверяем на ошибку авторизации
@@ -302,10 +598,11 @@ class MattermostBot:
                     else:
                         logger.error(f"Ошибка получения DM каналов: {e}")
 
-                last_check = current_time
-
-                # Пауза между проверками
-                self._sleep_with_stop(10)
+                # Пауза между проверками; при пробуждении сразу перечитываем
+                # список каналов, чтобы увидеть новый DM
+                if self._poll_wake.wait(10):
+                    self._poll_wake.clear()
+                    last_channels_refresh = 0.0
 
             except KeyboardInterrupt:
                 logger.info("Получен сигнал остановки HTTP polling")
@@ -314,22 +611,23 @@ class MattermostBot:
                 logger.error(f"Ошибка в HTTP polling: {e}")
                 self._sleep_with_stop(15)  # Пауза при ошибке
 
+        poll_executor.shutdown(wait=False, cancel_futures=True)
+
     def request_stop(self):
         """Запрос на остановку фоновых циклов бота."""
         self._stop_event.set()
+        self._poll_wake.set()
+        if getattr(self.driver, "websocket", None):
+            self.driver.disconnect()
 
     def _sleep_with_stop(self, seconds: int):
         """Прерываемый сон для быстрого graceful shutdown."""
-        end_time = time.time() + max(0, seconds)
-        while time.time() < end_time:
-            if self._stop_event.is_set():
-                break
-            time.sleep(0.2)
+        self._stop_event.wait(max(0, seconds))
 
     def handle_post_sync(self, post):
         """Синхронная обработка поста из HTTP polling"""
         try:
-            logger.debug(f"Обрабатываем пост: {post.get('id', 'unknown')}")
+            logger.debug("Обрабатываем пост: %s", post.get("id", "unknown"))
 
             # Игнорируем сообщения от самого бота
             if post.get("user_id") == self.bot_user["id"]:
@@ -342,15 +640,18 @@ class MattermostBot:
             user_id = post.get("user_id")
 
             logger.info(
-                f"Пост от пользователя {user_id}: '{message[:50]}...' в канале {channel_id}"
+                "Пост от пользователя %s: '%.50s...' в канале %s",
+                user_id,
+                message,
+                channel_id,
             )
 
             # Проверяем что это прямое сообщение
             if self._is_direct_message(channel_id):
-                logger.info(f"Обрабатываем DM сообщение от пользователя {user_id}")
+                logger.info("Обрабатываем DM сообщение от пользователя %s", user_id)
                 self.handle_message_sync(message, channel_id, user_id)
             else:
-                logger.debug(f"Канал {channel_id} не является прямым сообщением")
+                logger.debug("Канал %s не является прямым сообщением", channel_id)
 
         except Exception as e:
             logger.error(f"Ошибка обработки поста: {e}")
@@ -366,7 +667,7 @@ class MattermostBot:
 
             # Обрабатываем сообщения
             elif event_type == "posted":
-                post = json.loads(event["data"]["post"])
+                post = _loads(event["data"]["post"])
 
                 # Игнорируем сообщения от самого бота
                 if post.get("user_id") == self.bot_user["id"]:
@@ -380,19 +681,25 @@ class MattermostBot:
                 # Проверяем что это прямое сообщение
                 if self._is_direct_message(channel_id):
                     logger.info(
-                        f"🔥 WEBSOCKET: Получено сообщение от пользователя {user_id} в канале {channel_id}"
+                        "🔥 WEBSOCKET: Получено сообщение от пользователя %s в канале %s",
+                        user_id,
+                        channel_id,
                     )
                     self.handle_message_sync(message, channel_id, user_id)
                 else:
                     # Логируем, что бот не отвечает в каналах
                     logger.debug(
-                        f"Игнорируем сообщение в канале {channel_id}: бот работает только в прямых сообщениях"
+                        "Игнорируем сообщение в канале %s: бот работает только в прямых сообщениях",
+                        channel_id,
                     )
 
             # Обрабатываем добавление пользователей в каналы (включая DM)
             elif event_type == "user_added":
                 self._handle_user_added_sync(event)
 
+            elif event_type == "user_removed":
+                self._handle_user_removed_sync(event)
+
             # Обрабатываем события пользователей (может помочь при создании новых DM)
             elif event_type == "hello":
                 logger.info("🔄 WebSocket подключение установлено")
@@ -409,13 +716,15 @@ class MattermostBot:
 
     def _handle_channel_created_sync(self, event):
         """Обработка создания нового канала"""
+        # Новый канал может оказаться DM с ботом - проверяем сразу
+        self._poll_wake.set()
         try:
-            channel_data = json.loads(event.get("data", "{}"))
-            channel = channel_data.get("channel", {})
+            # data события уже разобрана вместе с самим событием и содержит
+            # только channel_id и team_id
+            channel_id = (event.get("data") or {}).get("channel_id")
 
-            if channel.get("type") == "D":  # Direct message
-                logger.info(f"Создан новый DM канал: {channel.get('id')}")
-                # Дополнительная логика при необходимости
+            if channel_id and self._is_direct_message(channel_id):
+                logger.info(f"Создан новый DM канал: {channel_id}")
 
         except Exception as e:
             logger.error(f"Ошибка обработки создания канала: {e}")
@@ -429,15 +738,114 @@ class MattermostBot:
 
             if channel_id and self._is_direct_message(channel_id):
                 logger.info(f"Пользователь {user_id} добавлен в DM канал {channel_id}")
+                self._poll_wake.set()
 
         except Exception as e:
             logger.error(f"Ошибка обработки добавления пользователя: {e}")
 
+    def _handle_user_removed_sync(self, event):
+        """Обработка удаления пользователя из канала"""
+        try:
+            broadcast = event.get("broadcast", {})
+            data = event.get("data", {})
+            channel_id = data.get("channel_id") or broadcast.get("channel_id")
+            user_id = data.get("user_id") or broadcast.get("user_id")
+
+            if user_id == self.bot_user["id"] and channel_id:
+                self._forget_channel_access(channel_id)
+                logger.info(f"Бот удален из канала {channel_id}")
+
+        except Exception as e:
+            logger.error(f"Ошибка обработки удаления пользователя: {e}")
+
+    def _get_team_id(self) -> Optional[str]:
+        """ID команды бота: из MATTERMOST_TEAM_ID или первая команда бота.
+
+        Результат автоопределения запоминается, поэтому список команд
+        запрашивается только до первого успешного ответа.
+        """
+        if self._team_id:
+            return self._team_id
+
+        if Config.MATTERMOST_TEAM_ID:
+            self._team_id = Config.MATTERMOST_TEAM_ID
+        else:
+            teams = self.driver.teams.get_user_teams(self.bot_user["id"])
+            if teams:
+                self._team_id = teams[0]["id"]
+                logger.info(f"Автоматически определен team_id: {self._team_id}")
+
+        return self._team_id
+
+    def _get_username(self, user_id: str) -> str:
+        """Имя пользователя Mattermost с кэшированием на USERNAME_CACHE_TTL"""
+        return self._resolve_usernames({user_id}).get(user_id, "unknown")
+
+    def _resolve_usernames(self, user_ids) -> Dict[str, str]:
+        """Имена пользователей Mattermost по их ID.
+
+        Имена берутся из кэша, а все промахи запрашиваются одним
+        POST /users/ids вместо отдельного запроса на каждого пользователя.
+        """
+        now = time.monotonic()
+        usernames = {}
+        misses = []
+        for user_id in user_ids:
+            cached = self._username_cache.get(user_id)
+            if cached and now - cached[1] < self.USERNAME_CACHE_TTL:
+                usernames[user_id] = cached[0]
+            else:
+                misses.append(user_id)
+
+        if misses:
+            for user in self.driver.users.get_users_by_ids(misses):
+                username = user.get("username", "unknown")
+                self._username_cache[user["id"]] = (username, now)
+                usernames[user["id"]] = username
+
+        return usernames
+
+    @cached_property
+    def excel_generator(self):
+        """Генератор отчетов создается при первом отчете.
+
+        Импорт openpyxl заметно замедляет запуск, а нужен только для отчетов.
+        """
+        from excel_generator import ExcelGenerator
+
+        return ExcelGenerator()
+
+    def _get_jira_client(self, user_id: str) -> Optional["JiraClient"]:
+        """Подключенный Jira клиент пользователя или None без учетных данных.
+
+        Клиент переиспользуется JIRA_CLIENT_TTL секунд, после чего подключение
+        создается заново (на случай истекшей сессии Jira).
+        """
+        cached = self._jira_clients.get(user_id)
+        if cached and time.monotonic() - cached[1] < self.JIRA_CLIENT_TTL:
+            return cached[0]
+
+        username, password = self.user_auth.get_user_credentials(user_id)
+        if not username or not password:
+            return None
+
+        # Библиотека jira импортируется при первом обращении к Jira
+        from jira_client import JiraClient
+
+        jira_client = JiraClient(str(username), str(password))
+        self._jira_clients[user_id] = (jira_client, time.monotonic())
+        return jira_client
+
     def _is_direct_message(self, channel_id: str) -> bool:
         """Проверка, является ли канал приватным сообщением"""
+        cached = self._dm_type_cache.get(channel_id)
+        if cached is not None:
+            return cached
+
         try:
             channel = self.driver.channels.get_channel(channel_id)
             is_dm = channel.get("type") == "D"
+            self._dm_type_cache[channel_id] = is_dm
 
             # Логируем информацию о канале для отладки
             if is_dm:
@@ -455,18 +863,18 @@ class MattermostBot:
     def handle_message_sync(self, message: str, channel_id: str, user_id: str):
         """Обработка сообщения пользователя"""
         try:
-            logger.info(
-                f"📝 Обрабатываем сообщение от {user_id}: '{message[:50]}{'...' if len(message) > 50 else ''}'"
-            )
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    f"📝 Обрабатываем сообщение от {user_id}: '{message[:50]}{'...' if len(message) > 50 else ''}'"
+                )
 
             # Получаем информацию о пользователе для логирования
             try:
-                user_info = self.driver.users.get_user(user_id)
-                username = user_info.get("username", "unknown")
-                logger.info(f"👤 Пользователь: {username} (ID: {user_id})")
+                username = self._get_username(user_id)
+                logger.info("👤 Пользователь: %s (ID: %s)", username, user_id)
             except Exception as e:
                 logger.debug(
-                    f"Не удалось получить информацию о пользователе {user_id}: {e}"
+                    "Не удалось получить информацию о пользователе %s: %s", user_id, e
                 )
                 username = "unknown"
 
@@ -478,38 +886,25 @@ class MattermostBot:
                 return
 
             message_lower = message.lower().strip()
+            commands = _match_commands(message_lower)
 
-            # Команды бота
-            if any(cmd in message_lower for cmd in ["помощь", "help", "команды"]):
-                logger.info(f"🔍 Команда 'помощь' от пользователя {username}")
-                self.send_help_sync(channel_id)
-
-            elif any(
-                cmd in message_lower
-                for cmd in ["настройка", "подключение", "авторизация"]
-            ):
-                logger.info(f"🔐 Команда 'настройка' от пользователя {username}")
-                self.start_jira_auth_sync(channel_id, user_id)
-
-            elif any(cmd in message_lower for cmd in ["проекты", "список проектов"]):
-                logger.info(f"📋 Команда 'проекты' от пользователя {username}")
-                self.send_projects_list_sync(channel_id, user_id)
-
-            elif "отчет" in message_lower or "трудозатраты" in message_lower:
-                logger.info(f"📊 Команда 'отчет' от пользователя {username}")
-                self.start_report_generation_sync(channel_id, user_id)
-
-            elif "сброс" in message_lower or "очистить" in message_lower:
-                logger.info(f"🗑️ Команда 'сброс' от пользователя {username}")
-                self.reset_user_auth_sync(channel_id, user_id)
-
-            elif self.user_auth.get_user_session(user_id):
-                logger.info(f"📊 Обработка ввода сессии от пользователя {username}")
-                self.handle_session_input_sync(message, channel_id, user_id)
+            # Команды бота: первый по приоритету найденный тег определяет обработчик
+            for tag, handler_name, title in _COMMAND_DISPATCH:
+                if tag in commands:
+                    logger.info("%s от пользователя %s", title, username)
+                    getattr(self, handler_name)(channel_id, user_id)
+                    return
 
+            if session := self.user_auth.get_user_session(user_id):
+                logger.info("📊 Обработка ввода сессии от пользователя %s", username)
+                self.handle_session_input_sync(
+                    message, channel_id, user_id, session, message_lower
+                )
             else:
                 logger.info(
-                    f"❓ Неизвестная команда от пользователя {username}: '{message[:30]}...'"
+                    "❓ Неизвестная команда от пользователя %s: '%.30s...'",
+                    username,
+                    message,
                 )
                 self.send_unknown_command_sync(channel_id)
 
@@ -519,55 +914,9 @@ class MattermostBot:
                 channel_id, "Произошла ошибка при обработке команды"
             )
 
-    def send_help_sync(self, channel_id: str):
-        """Отправка справки по командам"""
-        help_text = """
-**Бот для выгрузки трудозатрат из Jira** 📊
-
-**Первый запуск:**
-• `настройка` - подключение к вашему аккаунту Jira
-
-**Доступные команды:**
-• `проекты` - показать список доступных проектов
-• `отчет` или `трудозатраты` - сгенерировать отчет по трудозатратам
-• `сброс` - очистить сохраненные данные авторизации
-• `помощь` - показать эту справку
-
-**Для генерации отчета:**
-1. Убедитесь, что вы подключены к Jira (`настройка`)
-2. Введите команду `отчет`
-3. Выберите один или несколько проектов:
-   • Один проект: `PROJ`
-   • Несколько проектов: `PROJ1, PROJ2, PROJ3`
-4. Укажите период (начальную и конечную дату)
-5. Получите Excel файл с трудозатратами
-
-**📅 Указание периода (в свободном формате):**
-• `прошлая неделя`, `эта неделя`
-• `прошлый квартал`, `этот квартал`
-• `2 квартал 2024`, `первый квартал`, `II квартал`
-• `прошлый месяц`, `этот месяц` 
-• `май`, `июнь 2024`
-• `с мая по июнь`
-• `с 15 мая по 20 июня`
-• `последние 7 дней`, `последние 2 недели`
-• `2024-01-01` (один день)
-• `с 2024-01-01 по 2024-01-31`
-
-**Безопасность:**
-• Каждый пользователь подключается под своим аккаунтом Jira
-• Доступны только те проекты, к которым у вас есть права
-• Учетные данные хранятся в зашифрованном виде
-
-**Дополнительные возможности:**
-• При выборе нескольких проектов создается сводный отчет
-• Данные сортируются по дате и включают статистику по каждому проекту
-• Поддерживается неограниченное количество проектов в одном отчете
-
-**📚 Полезные ссылки:**
-• Инструкция по загрузке эксель файла в КСУП - https://confluence.1solution.ru/x/ZgwgGQ
-        """
-        self.send_message_sync(channel_id, help_text)
+    def send_help_sync(self, channel_id: str, user_id: Optional[str] = None):
+        """Отправка справки по командам (одинаковой для всех пользователей)"""
+        self.send_message_sync(channel_id, HELP_TEXT)
 
     def start_jira_auth_sync(self, channel_id: str, user_id: str):
         """Начало процесса аутентификации в Jira"""
@@ -586,14 +935,7 @@ class MattermostBot:
                 return
 
             # Запрашиваем имя пользователя
-            message = """
-🔐 **Настройка подключения к Jira**
-
-**Шаг 1 из 2:** Введите ваше имя пользователя для подключения к Jira
-
-**Пример:** john.doe или john_doe
-            """
-            self.send_message_sync(channel_id, message)
+            self.send_message_sync(channel_id, AUTH_PROMPT)
 
             # Сохраняем состояние ожидания имени пользователя
             self.user_auth.update_user_session(
@@ -608,14 +950,9 @@ class MattermostBot:
         """Сброс аутентификации пользователя"""
         try:
             self.user_auth.remove_user_credentials(user_id)
-            message = """
-🗑️ **Данные авторизации очищены**
-
-Ваши учетные данные Jira удалены из системы.
-
-Для повторного подключения введите команду `настройка`.
-            """
-            self.send_message_sync(channel_id, message)
+            self._username_cache.pop(user_id, None)
+            self._jira_clients.pop(user_id, None)
+            self.send_message_sync(channel_id, RESET_CONFIRM)
 
         except Exception as e:
             logger.error(f"Ошибка сброса аутентификации: {e}")
@@ -628,23 +965,20 @@ class MattermostBot:
             if not self.user_auth.is_user_authenticated(user_id):
                 self.send_message_sync(
                     channel_id,
-                    "❌ **Требуется подключение к Jira**\n\n"
-                    "Введите команду `настройка` для подключения к вашему аккаунту Jira.",
+                    AUTH_REQUIRED_TEXT,
                 )
                 return
 
             # Получаем учетные данные пользователя
-            username, password = self.user_auth.get_user_credentials(user_id)
+            jira_client = self._get_jira_client(user_id)
 
-            if not username or not password:
+            if jira_client is None:
                 self.send_message_sync(
                     channel_id,
                     "❌ Учетные данные не найдены. Выполните команду `настройка`",
                 )
                 return
 
-            # Создаем Jira клиент для пользователя (после проверки выше username и password точно не None)
-            jira_client = JiraClient(str(username), str(password))
             projects = jira_client.get_projects()
 
             if not projects:
@@ -673,8 +1007,7 @@ class MattermostBot:
             if not self.user_auth.is_user_authenticated(user_id):
                 self.send_message_sync(
                     channel_id,
-                    "❌ **Требуется подключение к Jira**\n\n"
-                    "Введите команду `настройка` для подключения к вашему аккаунту Jira.",
+                    AUTH_REQUIRED_TEXT,
                 )
                 return
 
@@ -685,11 +1018,7 @@ class MattermostBot:
 
             self.send_message_sync(
                 channel_id,
-                "📋 **Генерация отчета по трудозатратам**\n\n"
-                "Введите ключ проекта или несколько ключей через запятую:\n"
-                "• Один проект: `PROJ`\n"
-                "• Несколько проектов: `PROJ1, PROJ2, PROJ3`\n"
-                "• Введите `проекты` для просмотра списка доступных проектов",
+                REPORT_PROMPT,
             )
         except Exception as e:
             logger.error(f"Ошибка начала генерации отчета: {e}")
@@ -697,39 +1026,52 @@ class MattermostBot:
                 channel_id, "Ошибка инициализации генерации отчета"
             )
 
-    def handle_session_input_sync(self, message: str, channel_id: str, user_id: str):
-        """Обработка ввода в рамках сессии пользователя"""
+    def handle_session_input_sync(
+        self,
+        message: str,
+        channel_id: str,
+        user_id: str,
+        session: Optional[UserSession] = None,
+        message_lower: Optional[str] = None,
+    ):
+        """Обработка ввода в рамках сессии пользователя
+
+        message_lower - уже нормализованный (lower + strip) текст сообщения, если
+        вызывающий код его посчитал. Исходный message нужен для логина и пароля.
+        """
         try:
-            session = self.user_auth.get_user_session(user_id)
-            step = session.get("step")
+            if session is None:
+                session = self.user_auth.get_user_session(user_id)
+                if session is None:
+                    return
+            if message_lower is None:
+                message_lower = message.lower().strip()
+            step = session.step
 
             # Обработка аутентификации
             if step == "waiting_username":
                 self._handle_username_input_sync(message, channel_id, user_id)
                 return
             elif step == "waiting_password":
-                self._handle_password_input_sync(message, channel_id, user_id)
+                self._handle_password_input_sync(message, channel_id, user_id, session)
                 return
 
             # Генерация отчета
             if step == "project_selection":
-                if "проекты" in message:
+                if "проекты" in message_lower:
                     self.send_projects_list_sync(channel_id, user_id)
                     return
 
                 # Получаем учетные данные пользователя
-                username, password = self.user_auth.get_user_credentials(user_id)
+                jira_client = self._get_jira_client(user_id)
 
-                if not username or not password:
+                if jira_client is None:
                     self.send_message_sync(
                         channel_id,
                         "❌ Учетные данные не найдены. Выполните команду `настройка`",
                     )
                     return
 
-                # После проверки выше username и password точно не None
-                jira_client = JiraClient(str(username), str(password))
-
                 # Обрабатываем несколько проектов через запятую
                 project_keys = [key.strip().upper() for key in message.split(",")]
                 projects = jira_client.get_projects()
@@ -738,10 +1080,9 @@ class MattermostBot:
                 selected_projects = []
                 invalid_projects = []
 
+                projects_by_key = {p["key"]: p for p in projects}
                 for project_key in project_keys:
-                    project = next(
-                        (p for p in projects if p["key"] == project_key), None
-                    )
+                    project = projects_by_key.get(project_key)
                     if project:
                         selected_projects.append(project)
                     else:
@@ -779,66 +1120,34 @@ class MattermostBot:
                         projects_list
                     )
 
-                help_text = """
-**Примеры периодов:**
-• `прошлая неделя` или `эта неделя`
-• `прошлый квартал` или `этот квартал`
-• `2 квартал 2024` или `первый квартал`
-• `прошлый месяц` или `этот месяц`  
-• `май` или `июнь 2024`
-• `с мая по июнь`
-• `с 15 мая по 20 июня`
-• `последние 7 дней`
-• `последние 2 недели`
-• `2024-01-01` (один день)
-• `с 2024-01-01 по 2024-01-31`
-
-**Или стандартный формат:** YYYY-MM-DD"""
-
                 self.send_message_sync(
                     channel_id,
                     f"✅ Выбрано {projects_text}\n\n"
                     "📅 **Укажите период для отчета:**\n"
-                    f"{help_text}",
+                    f"{DATE_HELP}",
                 )
 
             elif step == "date_period":
                 # Парсим период с помощью нового парсера
                 start_date, end_date, explanation = self.date_parser.parse_period(
-                    message
+                    message_lower
                 )
 
                 if not start_date or not end_date:
                     # Показываем ошибку и примеры
-                    help_text = """
-**Попробуйте один из примеров:**
-• `прошлая неделя` - за прошлую неделю
-• `этот месяц` - текущий месяц
-• `май 2024` - май конкретного года  
-• `с мая по июнь` - период между месяцами
-• `последние 7 дней` - последняя неделя
-• `2024-01-01` - конкретный день
-• `с 2024-01-01 по 2024-01-31` - точный период"""
-
-                    self.send_message_sync(channel_id, f"{explanation}\n\n{help_text}")
+                    self.send_message_sync(
+                        channel_id, f"{explanation}\n\n{DATE_RETRY_HELP}"
+                    )
                     return
 
-                # Сохраняем распознанные даты
-                self.user_auth.update_user_session(
-                    user_id, start_date=start_date, end_date=end_date
+                # Даты нужны только на время генерации отчета, поэтому не
+                # сохраняем их в сессию, а передаем локальной копией
+                report_session = replace(
+                    session, start_date=start_date, end_date=end_date
                 )
 
-                # Показываем что распознали и генерируем отчет
-                self.send_message_sync(channel_id, explanation)
-
-                session = self.user_auth.get_user_session(
-                    user_id
-                )  # Получаем обновленную сессию
-
-                # Генерируем отчет
-                self.generate_and_send_report_sync(session, user_id)
-
-                # Очищаем сессию
+                # Очищаем сессию (единственная запись сессии за этот шаг) до
+                # запуска генерации, чтобы пользователь мог сразу начать новый отчет
                 self.user_auth.update_user_session(
                     user_id,
                     step=None,
@@ -848,6 +1157,15 @@ class MattermostBot:
                     channel_id=None,
                 )
 
+                # Генерируем отчет в фоне, не блокируя обработку других сообщений.
+                # Распознанный период показываем в том же сообщении, что и статус
+                self._report_executor.submit(
+                    self.generate_and_send_report_sync,
+                    report_session,
+                    user_id,
+                    explanation,
+                )
+
         except Exception as e:
             logger.error(f"Ошибка обработки сессии: {e}")
             self.send_error_message_sync(channel_id, "Ошибка обработки команды")
@@ -870,18 +1188,7 @@ class MattermostBot:
                 user_id, temp_username=username, step="waiting_password"
             )
 
-            message = """
-✅ **Имя пользователя сохранено**
-
-**Шаг 2 из 2:** Отправьте ваш пароль для Jira текстовым сообщением
-
-**Важно:** 
-- Используйте ваш обычный пароль от Jira
-- Пароль будет сохранен в зашифрованном виде
-- Никто не сможет увидеть ваш пароль в открытом виде
-- Просто напишите пароль в ответном сообщении
-            """
-            self.send_message_sync(channel_id, message)
+            self.send_message_sync(channel_id, PASSWORD_PROMPT)
 
         except Exception as e:
             logger.error(f"Ошибка обработки имени пользователя: {e}")
@@ -889,14 +1196,21 @@ class MattermostBot:
                 channel_id, "Ошибка обработки имени пользователя"
             )
 
-    def _handle_password_input_sync(self, password: str, channel_id: str, user_id: str):
+    def _handle_password_input_sync(
+        self,
+        password: str,
+        channel_id: str,
+        user_id: str,
+        session: Optional[UserSession] = None,
+    ):
         """Обработка ввода пароля"""
         try:
             password = password.strip()
 
             # Получаем временно сохраненное имя пользователя
-            session = self.user_auth.get_user_session(user_id)
-            username = session.get("temp_username")
+            if session is None:
+                session = self.user_auth.get_user_session(user_id)
+            username = session.temp_username if session else None
 
             if not username:
                 self.send_message_sync(
@@ -914,12 +1228,16 @@ class MattermostBot:
             self.send_message_sync(channel_id, "🔄 Проверяю подключение к Jira...")
 
             # Тестируем подключение
+            from jira_client import JiraClient
+
             jira_client = JiraClient()
             success, message = jira_client.test_connection(username, password)
 
             if success:
                 # Сохраняем учетные данные
                 self.user_auth.save_user_credentials(user_id, username, password)
+                # Проверенное подключение сразу используем для следующих команд
+                self._jira_clients[user_id] = (jira_client, time.monotonic())
 
                 # Очищаем временные данные
                 self.user_auth.update_user_session(
@@ -947,71 +1265,83 @@ class MattermostBot:
             self.send_error_message_sync(channel_id, "Ошибка обработки пароля")
 
     def _validate_date(self, date_str: str) -> bool:
-        """Валидация формата даты"""
+        """Валидация формата даты YYYY-MM-DD"""
+        match = _DATE_RE.fullmatch(date_str.strip())
+        if not match:
+            return False
+        # Конструктор date отсекает несуществующие даты вроде 2024-02-30
         try:
-            datetime.strptime(date_str.strip(), "%Y-%m-%d")
-            return True
+            date(*map(int, match.groups()))
         except ValueError:
             return False
+        return True
 
-    def generate_and_send_report_sync(self, session: Dict, user_id: str):
-        """Генерация и отправка отчета"""
-        try:
-            channel_id = session["channel_id"]
-            projects = session["projects"]
-            start_date = session["start_date"]
-            end_date = session["end_date"]
+    def generate_and_send_report_sync(
+        self, session: UserSession, user_id: str, header: str = ""
+    ):
+        """Генерация и отправка отчета
 
+        header - текст, который добавляется в начало сообщения о старте генерации
+        """
+        try:
+            channel_id = session.channel_id
+            projects = session.projects
+            start_date = session.start_date
+            end_date = session.end_date
+            # Названия проектов нужны и для пустого результата, и для подписи
+            projects_names = ", ".join(p["name"] for p in projects)
+
+            progress = "⏳ Генерирую отчет... Это может занять некоторое время."
             self.send_message_sync(
-                channel_id, "⏳ Генерирую отчет... Это может занять некоторое время."
+                channel_id, f"{header}\n\n{progress}" if header else progress
             )
 
             # Получаем учетные данные пользователя
-            username, password = self.user_auth.get_user_credentials(user_id)
+            jira_client = self._get_jira_client(user_id)
 
-            if not username or not password:
+            if jira_client is None:
                 raise ValueError("Учетные данные пользователя не найдены")
 
-            # После проверки выше username и password точно не None
-            jira_client = JiraClient(str(username), str(password))
+            # Трудозатраты всех проектов получаем одним поиском в Jira.
+            # Число записей и часы по проектам считаем за один проход,
+            # не собирая промежуточные списки записей каждого проекта
+            all_worklogs = jira_client.get_worklogs_for_projects(
+                [p["key"] for p in projects], start_date, end_date
+            )
+            records_by_project = defaultdict(int)
+            hours_by_project = defaultdict(float)
+            for worklog in all_worklogs:
+                project_key = worklog["project_key"]
+                records_by_project[project_key] += 1
+                hours_by_project[project_key] += worklog["hours_value"]
 
-            # Получаем трудозатраты из Jira для всех проектов
-            all_worklogs = []
             project_stats = []
-
             for project in projects:
-                project_worklogs = jira_client.get_worklogs_for_project(
-                    project["key"], start_date, end_date
-                )
-
-                if project_worklogs:
-                    all_worklogs.extend(project_worklogs)
-                    project_hours = sum(
-                        float(w["hours"].replace(",", ".")) for w in project_worklogs
-                    )
+                project_records = records_by_project.get(project["key"])
+                if project_records:
+                    project_hours = hours_by_project[project["key"]]
                     project_stats.append(
                         {
                             "name": project["name"],
                             "key": project["key"],
-                            "records": len(project_worklogs),
+                            "records": project_records,
                             "hours": project_hours,
                         }
                     )
                     logger.info(
-                        f"Проект {project['key']}: {len(project_worklogs)} записей, {project_hours:.1f} ч"
+                        f"Проект {project['key']}: {project_records} записей, {project_hours:.1f} ч"
                     )
 
             if not all_worklogs:
-                projects_names = [p["name"] for p in projects]
                 self.send_message_sync(
                     channel_id,
-                    f"📭 Трудозатраты по проектам **{', '.join(projects_names)}** "
+                    f"📭 Трудозатраты по проектам **{projects_names}** "
                     f"за период с {start_date} по {end_date} не найдены.",
                 )
                 return
 
-            # Сортируем записи по дате
-            all_worklogs.sort(key=lambda x: x["date"])
+            # Сортируем записи по дате (строки YYYY-MM-DD HH:MM сортируются как даты)
+            all_worklogs.sort(key=itemgetter("date"))
 
             # Генерируем название для отчета
             if len(projects) == 1:
@@ -1019,18 +1349,14 @@ class MattermostBot:
             else:
                 report_name = f"Сводный отчет по {len(projects)} проектам"
 
-            # Генерируем Excel файл
-            excel_data = self.excel_generator.generate_timesheet_report(
-                all_worklogs, report_name, start_date, end_date, projects
-            )
-
             filename = self.excel_generator.generate_filename_for_multiple_projects(
                 projects, start_date, end_date
             )
 
-            # Формируем статистику для сообщения
-            total_records = len(all_worklogs)
-            total_hours = sum(float(w["hours"].replace(",", ".")) for w in all_worklogs)
+            # Формируем статистику для сообщения: итоги складываем из уже
+            # посчитанной статистики по проектам, не проходя все записи заново
+            total_records = sum(stat["records"] for stat in project_stats)
+            total_hours = sum(stat["hours"] for stat in project_stats)
 
             # Формируем детальную статистику по проектам
             stats_text = ""
@@ -1039,57 +1365,59 @@ class MattermostBot:
                 for stat in project_stats:
                     stats_text += f"• **{stat['name']}** ({stat['key']}): {stat['records']} записей, {stat['hours']:.1f} ч\n"
 
-            # Отправляем файл
-            self.send_file_sync(
-                channel_id,
-                excel_data,
-                filename,
-                f"📊 **Отчет по трудозатратам готов!**\n\n"
-                f"**Проекты:** {', '.join([p['name'] for p in projects])}\n"
-                f"**Период:** с {start_date} по {end_date}\n"
-                f"**Всего записей:** {total_records}\n"
-                f"**Общее время:** {total_hours:.1f} ч"
-                f"{stats_text}",
-            )
-
-            # Отправляем подсказку о том, как сформировать новый отчёт
-            help_message = """
-🔄 **Хотите создать новый отчёт?**
-
-**Быстрые команды:**
-• `отчет` - создать новый отчёт
-• `проекты` - посмотреть доступные проекты
-• `помощь` - полная справка по командам
+            # Генерируем Excel файл во временный файл и отправляем его оттуда.
+            # Небольшие отчеты остаются в памяти, крупные (больше
+            # REPORT_SPOOL_MAX_SIZE) уходят на диск. Файл удаляется при закрытии
+            with tempfile.SpooledTemporaryFile(
+                max_size=self.REPORT_SPOOL_MAX_SIZE, suffix=".xlsx"
+            ) as report_file:
+                self.excel_generator.write_timesheet_report(
+                    report_file,
+                    all_worklogs,
+                    report_name,
+                    start_date,
+                    end_date,
+                    projects,
+                )
+                report_file.seek(0)
 
-**💡 Совет:** Можете сразу написать `отчет` для быстрого создания нового отчёта!
-            """
-            self.send_message_sync(channel_id, help_message)
+                self.send_file_sync(
+                    channel_id,
+                    report_file,
+                    filename,
+                    f"📊 **Отчет по трудозатратам готов!**\n\n"
+                    f"**Проекты:** {projects_names}\n"
+                    f"**Период:** с {start_date} по {end_date}\n"
+                    f"**Всего записей:** {total_records}\n"
+                    f"**Общее время:** {total_hours:.1f} ч"
+                    f"{stats_text}\n\n"
+                    # Подсказка о новом отчете - в том же посте, что и файл
+                    f"{NEXT_REPORT_HINT}",
+                )
 
         except Exception as e:
             logger.error(f"Ошибка генерации отчета: {e}")
             self.send_error_message_sync(
-                session["channel_id"], "Произошла ошибка при генерации отчета"
+                session.channel_id, "Произошла ошибка при генерации отчета"
             )
 
     def send_message_sync(self, channel_id: str, message: str):
         """Отправка сообщения в канал"""
         try:
-            # Ограничиваем длину сообщения (лимит Mattermost ~16384 символа)
-            max_length = 15000
-            if len(message) > max_length:
+            if len(message) > MESSAGE_MAX_LENGTH:
                 # Обрезаем сообщение и добавляем предупреждение
-                truncated_message = (
-                    message[: max_length - 200]
-                    + "\n\n⚠️ **Сообщение обрезано из-за ограничений длины**"
-                )
                 logger.warning(
-                    f"Сообщение обрезано с {len(message)} до {len(truncated_message)} символов"
+                    f"Сообщение обрезано с {len(message)} до {MESSAGE_MAX_LENGTH} символов"
                 )
-                message = truncated_message
+                message = message[:_TRUNCATED_BODY_LENGTH] + TRUNCATION_NOTICE
 
             self.driver.posts.create_post(
                 {"channel_id": channel_id, "message": message}
             )
+        except (NotEnoughPermissions, ResourceNotFound) as e:
+            # Канал недоступен: писать в него сообщение об ошибке бессмысленно
+            logger.error(f"Нет доступа к каналу {channel_id}: {e}")
+            self._forget_channel_access(channel_id)
         except Exception as e:
             logger.error(f"Ошибка отправки сообщения: {e}")
             # Попытка отправить короткое сообщение об ошибке
@@ -1102,9 +1430,17 @@ class MattermostBot:
                 logger.error("Не удалось отправить даже сообщение об ошибке")
 
     def send_file_sync(
-        self, channel_id: str, file_data: bytes, filename: str, message: str = ""
+        self,
+        channel_id: str,
+        file_data: bytes | BinaryIO,
+        filename: str,
+        message: str = "",
     ):
-        """Отправка файла в канал"""
+        """Отправка файла в канал
+
+        file_data - содержимое файла или открытый бинарный файл, который
+        читается при загрузке
+        """
         try:
             # Загружаем файл
             file_response = self.driver.files.upload_file(
@@ -1135,21 +1471,13 @@ class MattermostBot:
 
     def send_unknown_command_sync(self, channel_id: str):
         """Отправка сообщения о неизвестной команде"""
-        message = """
-❓ **Не понимаю команду**
-
-**Попробуйте:**
-• `помощь` - список всех команд
-• `настройка` - подключение к Jira
-• `отчет` - создать отчет по трудозатратам
-
-**Для новых пользователей:** начните с команды `настройка`
-        """
-        self.send_message_sync(channel_id, message)
+        self.send_message_sync(channel_id, UNKNOWN_COMMAND_TEXT)
 
     def disconnect(self):
         """Отключение от Mattermost"""
         self.request_stop()
+        # Записываем отложенные изменения сессий пользователей
+        self.user_auth.flush()
         if not self._connected:
             logger.info(
                 "Пропускаем logout: соединение с Mattermost не было установлено"
@@ -1160,6 +1488,9 @@ class MattermostBot:
             logger.info("Отключились от Mattermost")
         except Exception as e:
             logger.error(f"Ошибка отключения: {e}")
+        finally:
+            self._event_executor.shutdown(wait=False, cancel_futures=True)
+            self._report_executor.shutdown(wait=False, cancel_futures=True)
 
     async def _verify_dm_channels(self):
         """Проверка доступности DM каналов для аутентифицированных пользователей"""
@@ -1177,11 +1508,14 @@ class MattermostBot:
 
     def _ensure_dm_channel_access(self, user_id: str, channel_id: str):
         """Обеспечение доступа к DM каналу"""
-        try:
-            # Получаем информацию о канале
-            channel = self.driver.channels.get_channel(channel_id)
+        # Доступ к DM каналу не меняется, пока не придет событие user_removed
+        # или сервер не ответит 403/404 (см. _forget_channel_access)
+        if (user_id, channel_id) in self._dm_access_cache:
+            return True
 
-            if channel.get("type") != "D":
+        try:
+            # Тип канала берется из кэша, без отдельного get_channel
+            if not self._is_direct_message(channel_id):
                 logger.warning(f"Канал {channel_id} не является DM каналом")
                 return False
 
@@ -1196,6 +1530,7 @@ class MattermostBot:
                 # В DM каналах бот автоматически становится участником при создании
                 return False
 
+            self._dm_access_cache.add((user_id, channel_id))
             logger.debug(f"Доступ к DM каналу {channel_id} подтвержден")
             return True
 
@@ -1203,68 +1538,30 @@ class MattermostBot:
             logger.error(f"Ошибка проверки доступа к каналу {channel_id}: {e}")
             return False
 
+    def _forget_channel_access(self, channel_id: str):
+        """Сброс подтвержденного доступа ко всем парам с этим каналом"""
+        self._dm_access_cache = {
+            key for key in self._dm_access_cache if key[1] != channel_id
+        }
+
     def create_or_get_dm_channel(self, user_id: str):
         """Создает или получает DM канал с пользователем"""
         try:
             logger.info(f"🔍 Ищем/создаем DM канал с пользователем {user_id}...")
 
-            # Сначала проверяем, существует ли уже DM канал
-            teams = self.driver.teams.get_user_teams(self.bot_user["id"])
-            all_channels = []
-
-            if teams:
-                team_id = teams[0]["id"]
-                all_channels = self.driver.channels.get_channels_for_user(
-                    self.bot_user["id"], team_id
-                )
-            else:
-                logger.warning(
-                    "Не найдено команд для пользователя при создании DM канала"
-                )
-            dm_channels = [ch for ch in all_channels if ch.get("type") == "D"]
-
-            # Ищем существующий канал с этим пользователем
-            for channel in dm_channels:
-                channel_id = channel["id"]
-                try:
-                    # Получаем участников канала
-                    members = self.driver.channels.get_channel_members(channel_id)
-                    member_ids = {member["user_id"] for member in members}
-
-                    # Проверяем, что в канале только бот и указанный пользователь
-                    if (
-                        user_id in member_ids
-                        and self.bot_user["id"] in member_ids
-                        and len(member_ids) == 2
-                    ):
-                        logger.info(f"✅ Найден существующий DM канал: {channel_id}")
-                        return channel_id
-
-                except Exception as e:
-                    logger.debug(f"Ошибка проверки канала {channel_id}: {e}")
-                    continue
-
-            # Если не найден, создаем новый DM канал
-            logger.info(f"📱 Создаем новый DM канал с пользователем {user_id}...")
-
+            # POST /channels/direct идемпотентен: для существующей пары
+            # возвращает уже созданный канал, поэтому перебирать каналы не нужно
             dm_channel = self.driver.channels.create_direct_message_channel(
                 [self.bot_user["id"], user_id]
             )
             channel_id = dm_channel["id"]
 
-            logger.info(f"✅ Создан новый DM канал: {channel_id}")
-
-            # Отправляем приветственное сообщение
-            welcome_message = """
-🤖 **Добро пожаловать!**
-
-Я бот для выгрузки трудозатрат из Jira в Excel формат.
-
-**Для начала работы введите:** `настройка`
-
-**Или посмотрите справку:** `помощь`
-            """
-            self.send_message_sync(channel_id, welcome_message)
+            # Приветствие только для нового канала, где еще не было сообщений
+            if not dm_channel.get("last_post_at"):
+                logger.info(f"✅ Создан новый DM канал: {channel_id}")
+                self.send_message_sync(channel_id, WELCOME_TEXT)
+            else:
+                logger.info(f"✅ Найден существующий DM канал: {channel_id}")
 
             return channel_id
 
@@ -1322,11 +1619,9 @@ class MattermostBot:
         try:
             if not channel_id:
                 # Если канал не указан, попробуем найти любой доступный DM канал
-                teams = self.driver.teams.get_user_teams(self.bot_user["id"])
-                channels = []
+                team_id = self._get_team_id()
 
-                if teams:
-                    team_id = teams[0]["id"]
+                if team_id:
                     channels = self.driver.channels.get_channels_for_user(
                         self.bot_user["id"], team_id
                     )
@@ -0,0 +1,25 @@
+from datetime import datetime
+
+from date_parser import DateParser
+
+
+def test_parse_period_reuses_result_for_same_normalized_text():
+    parser = DateParser()
+
+    first = parser.parse_period("Прошлая неделя")
+    second = parser.parse_period("  прошлая неделя ")
+
+    assert first == second
+    assert parser._parse_cached.cache_info().hits == 1
+
+
+def test_parse_period_recomputes_relative_period_on_new_day(monkeypatch):
+    parser = DateParser()
+    today = {"value": datetime(2024, 5, 15)}
+    monkeypatch.setattr(DateParser, "today", property(lambda self: today["value"]))
+
+    assert parser.parse_period("сегодня")[:2] == ("2024-05-15", "2024-05-15")
+
+    today["value"] = datetime(2024, 5, 16)
+
+    assert parser.parse_period("сегодня")[:2] == ("2024-05-16", "2024-05-16")
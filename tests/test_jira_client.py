@@ -1,3 +1,6 @@
+from types import SimpleNamespace
+
+from jira.resources import Issue
 from requests.exceptions import Timeout
 
 from jira_client import JiraClient
@@ -23,6 +26,26 @@ def test_test_connection_uses_configured_timeout(monkeypatch):
     assert captured_kwargs["timeout"] == (7, 7)
 
 
+def test_test_connection_uses_configured_search_page_size(monkeypatch):
+    captured_kwargs = {}
+
+    class FakeJira:
+        def __init__(self, *args, **kwargs):
+            captured_kwargs.update(kwargs)
+
+        def current_user(self):
+            return "demo-user"
+
+    monkeypatch.setattr("jira_client.JIRA", FakeJira)
+    monkeypatch.setattr("jira_client.Config.JIRA_SEARCH_PAGE_SIZE", 250, raising=False)
+
+    client = JiraClient()
+    success, _ = client.test_connection("user", "pass")
+
+    assert success is True
+    assert captured_kwargs["default_batch_sizes"] == {Issue: 250}
+
+
 def test_test_connection_returns_human_message_on_timeout(monkeypatch):
     class FakeJira:
         def __init__(self, *args, **kwargs):
@@ -36,3 +59,138 @@ def test_test_connection_returns_human_message_on_timeout(monkeypatch):
 
     assert success is False
     assert "Таймаут" in message
+
+
+def _issue(key, summary, project_key="PROJ"):
+    return SimpleNamespace(
+        key=key,
+        fields=SimpleNamespace(
+            summary=summary,
+            project=SimpleNamespace(key=project_key, name="Project"),
+        ),
+    )
+
+
+def _jira_worklog(started, seconds, comment=""):
+    return SimpleNamespace(
+        started=started,
+        timeSpentSeconds=seconds,
+        comment=comment,
+        author=SimpleNamespace(name="john", emailAddress="john@example.com"),
+    )
+
+
+def test_get_worklogs_for_project_returns_rows_within_period():
+    class FakeJira:
+        def search_issues(self, jql, **kwargs):
+            return [_issue("PROJ-1", "Task")]
+
+        def worklogs(self, issue_key):
+            return [
+                _jira_worklog("2024-05-02T10:00:00.000+0300", 5400, "done"),
+                _jira_worklog("2024-06-01T10:00:00.000+0300", 3600),
+            ]
+
+    client = JiraClient()
+    client.jira = FakeJira()
+
+    [row] = client.get_worklogs_for_project("PROJ", "2024-05-01", "2024-05-31")
+
+    assert row["date"] == "2024-05-02 00:00"
+    assert row["executor"] == "john"
+    assert row["hours"] == "1,5"
+    assert row["hours_value"] == 1.5
+    assert row["description"] == "PROJ-1 - Task: done"
+    assert row["project_task"] == "Сопровождение Май"
+
+
+def test_get_projects_is_cached_between_calls():
+    calls = []
+
+    class FakeJira:
+        def projects(self):
+            calls.append(True)
+            return [SimpleNamespace(key="PROJ", name="Project")]
+
+    client = JiraClient()
+    client.jira = FakeJira()
+
+    assert client.get_projects() == [{"key": "PROJ", "name": "Project"}]
+    assert client.get_projects() == [{"key": "PROJ", "name": "Project"}]
+    assert len(calls) == 1
+
+
+def test_get_worklogs_for_projects_uses_one_search_and_tags_project():
+    searches = []
+
+    class FakeJira:
+        def search_issues(self, jql, **kwargs):
+            searches.append((jql, kwargs))
+            return [
+                _issue("AKR-1", "T123 Доработка", project_key="AKR"),
+                _issue("PROJ-1", "Task"),
+            ]
+
+        def worklogs(self, issue_key):
+            return [_jira_worklog("2024-05-02T10:00:00.000+0300", 3600)]
+
+    client = JiraClient()
+    client.jira = FakeJira()
+
+    rows = client.get_worklogs_for_projects(["AKR", "PROJ"], "2024-05-01", "2024-05-31")
+
+    [(jql, kwargs)] = searches
+    assert 'project in ("AKR", "PROJ")' in jql
+    # Все страницы результата, а не только первая
+    assert kwargs["maxResults"] is False
+    assert [(r["project_key"], r["project_task"]) for r in rows] == [
+        ("AKR", "T123"),
+        ("PROJ", "Сопровождение Май"),
+    ]
+
+
+def test_get_worklogs_uses_worklogs_returned_by_search():
+    issue = _issue("PROJ-1", "Task")
+    issue.fields.worklog = SimpleNamespace(
+        total=1, worklogs=[_jira_worklog("2024-05-02T10:00:00.000+0300", 3600)]
+    )
+    del issue.fields.worklog.worklogs[0].comment
+
+    class FakeJira:
+        def search_issues(self, jql, **kwargs):
+            assert kwargs["fields"] == ["summary", "project", "worklog"]
+            return [issue]
+
+        def worklogs(self, issue_key):
+            raise AssertionError("worklogs уже есть в ответе поиска")
+
+    client = JiraClient()
+    client.jira = FakeJira()
+
+    [row] = client.get_worklogs_for_project("PROJ", "2024-05-01", "2024-05-31")
+
+    assert row["description"] == "PROJ-1 - Task"
+
+
+def test_get_worklogs_fetches_only_incomplete_issues_and_keeps_order():
+    fetched = []
+    inline = _issue("PROJ-2", "Inline")
+    inline.fields.worklog = SimpleNamespace(
+        total=1, worklogs=[_jira_worklog("2024-05-03T10:00:00.000+0300", 3600)]
+    )
+
+    class FakeJira:
+        def search_issues(self, jql, **kwargs):
+            return [_issue("PROJ-1", "First"), inline, _issue("PROJ-3", "Third")]
+
+        def worklogs(self, issue_key):
+            fetched.append(issue_key)
+            return [_jira_worklog("2024-05-02T10:00:00.000+0300", 3600)]
+
+    client = JiraClient()
+    client.jira = FakeJira()
+
+    rows = client.get_worklogs_for_projects(["PROJ"], "2024-05-01", "2024-05-31")
+
+    assert sorted(fetched) == ["PROJ-1", "PROJ-3"]
+    assert [r["task_summary"] for r in rows] == ["First", "Inline", "Third"]
@@ -0,0 +1,380 @@
+import asyncio
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from mattermostdriver.exceptions import NotEnoughPermissions
+from openpyxl import load_workbook
+
+import jira_client
+import mattermost_bot
+from mattermost_bot import MattermostBot, _match_commands
+from user_auth import UserAuthManager, UserSession
+
+
+class FakeDriver:
+    def __init__(self):
+        self.posts = self
+        self.created_posts = []
+
+    def create_post(self, options):
+        self.created_posts.append(options)
+        return {"id": f"post{len(self.created_posts)}"}
+
+
+@pytest.fixture
+def bot(monkeypatch, tmp_path):
+    sessions_file = str(tmp_path / "sessions.json")
+    monkeypatch.setattr(MattermostBot, "_create_driver", lambda self: FakeDriver())
+    monkeypatch.setattr(
+        mattermost_bot, "UserAuthManager", lambda: UserAuthManager(sessions_file)
+    )
+    instance = MattermostBot()
+    instance.bot_user = {"id": "bot", "username": "bot"}
+    yield instance
+    # Не оставляем рабочие потоки и отложенную запись сессий между тестами
+    instance._event_executor.shutdown(wait=True)
+    instance._report_executor.shutdown(wait=True)
+    instance.user_auth.flush()
+
+
+def test_match_commands_collects_all_command_tags_in_one_pass():
+    assert _match_commands("помощь") == {"help"}
+    assert _match_commands("покажи список проектов и отчет") == {
+        "projects",
+        "report",
+    }
+    assert _match_commands("привет") == set()
+    # Ключевое слово внутри другого слова по-прежнему распознается
+    assert _match_commands("отчеты") == {"report"}
+
+
+def test_date_period_input_persists_session_once(bot, monkeypatch):
+    bot.user_auth.update_user_session(
+        "u1",
+        step="date_period",
+        channel_id="c1",
+        projects=[{"key": "PROJ", "name": "Project"}],
+    )
+    reports = []
+    saves = []
+    monkeypatch.setattr(
+        bot,
+        "generate_and_send_report_sync",
+        lambda s, u, header: reports.append((s, header)),
+    )
+    monkeypatch.setattr(
+        bot.user_auth, "_save_sessions", lambda *args: saves.append(True)
+    )
+
+    bot.handle_session_input_sync("2024-01-01", "c1", "u1")
+    bot._report_executor.shutdown(wait=True)
+
+    report_session, header = reports[0]
+    assert report_session.start_date == "2024-01-01"
+    assert report_session.end_date == "2024-01-01"
+    # Распознанный период уходит вместе со статусом генерации, а не отдельно
+    assert "2024" in header
+    assert bot.driver.created_posts == []
+    assert bot.user_auth.get_user_session("u1").step is None
+    assert len(saves) == 1
+
+
+def test_websocket_event_is_parsed_and_handled_off_the_event_loop(bot, monkeypatch):
+    handled = []
+    monkeypatch.setattr(bot, "handle_event", handled.append)
+
+    asyncio.run(bot._handle_websocket_event('{"event": "hello", "data": {}}'))
+    bot._event_executor.shutdown(wait=True)
+
+    assert handled == [{"event": "hello", "data": {}}]
+
+
+class FakePollingDriver(FakeDriver):
+    def __init__(self, posts):
+        super().__init__()
+        self.channels = self
+        self.users = self
+        self.teams = self
+        self._posts = posts
+        self.posts_requests = []
+        self.users_requests = []
+
+    def get_channels_for_user(self, user_id, team_id):
+        return [{"id": "dm1", "type": "D"}, {"id": "town", "type": "O"}]
+
+    def get_posts_for_channel(self, channel_id, params=None):
+        self.posts_requests.append((channel_id, params))
+        # Как и сервер, отдаем order от новых постов к старым
+        order = sorted(
+            self._posts, key=lambda post_id: self._posts[post_id]["create_at"]
+        )
+        return {"order": order[::-1], "posts": self._posts}
+
+    def get_users_by_ids(self, user_ids):
+        self.users_requests.append(sorted(user_ids))
+        return [{"id": user_id, "username": user_id} for user_id in user_ids]
+
+
+def test_http_polling_requests_only_new_posts_of_dm_channels(bot, monkeypatch):
+    monkeypatch.setattr(mattermost_bot.Config, "MATTERMOST_TEAM_ID", "team")
+    now = int(mattermost_bot.time.time() * 1000)
+    bot.driver = FakePollingDriver(
+        {
+            "old": {"create_at": now - 60_000, "user_id": "u1", "message": "old"},
+            "new": {"create_at": now + 60_000, "user_id": "u1", "message": "new"},
+            "own": {"create_at": now + 60_000, "user_id": "bot", "message": "own"},
+        }
+    )
+    handled = []
+
+    def handle_message_sync(message, channel_id, user_id):
+        handled.append((message, channel_id, user_id))
+        bot.request_stop()
+
+    monkeypatch.setattr(bot, "handle_message_sync", handle_message_sync)
+
+    bot.start_http_polling()
+
+    assert handled == [("new", "dm1", "u1")]
+    assert [channel for channel, _ in bot.driver.posts_requests] == ["dm1"]
+    assert "since" in bot.driver.posts_requests[0][1]
+    assert bot.driver.users_requests == [["u1"]]
+
+
+def test_is_direct_message_caches_channel_type(bot):
+    requested = []
+
+    class Channels:
+        def get_channel(self, channel_id):
+            requested.append(channel_id)
+            return {"id": channel_id, "type": "D"}
+
+    bot.driver.channels = Channels()
+
+    assert bot._is_direct_message("dm1") is True
+    assert bot._is_direct_message("dm1") is True
+    assert requested == ["dm1"]
+
+
+def test_jira_client_is_reused_until_credentials_are_reset(bot, monkeypatch):
+    created = []
+
+    class FakeJiraClient:
+        def __init__(self, username, password):
+            created.append((username, password))
+
+    monkeypatch.setattr(jira_client, "JiraClient", FakeJiraClient)
+    bot.user_auth.save_user_credentials("u1", "john", "secret")
+
+    first = bot._get_jira_client("u1")
+    assert bot._get_jira_client("u1") is first
+
+    bot.reset_user_auth_sync("c1", "u1")
+
+    assert bot._get_jira_client("u1") is None
+    assert created == [("john", "secret")]
+
+
+def test_jira_client_is_recreated_after_ttl(bot, monkeypatch):
+    monkeypatch.setattr(jira_client, "JiraClient", lambda u, p: object())
+    monkeypatch.setattr(bot, "JIRA_CLIENT_TTL", 0)
+    bot.user_auth.save_user_credentials("u1", "john", "secret")
+
+    assert bot._get_jira_client("u1") is not bot._get_jira_client("u1")
+
+
+def test_handle_message_dispatches_highest_priority_command(bot, monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot, "_get_username", lambda user_id: user_id)
+    monkeypatch.setattr(bot, "_is_direct_message", lambda channel_id: True)
+    monkeypatch.setattr(
+        bot, "send_help_sync", lambda c, u: calls.append(("help", c, u))
+    )
+    monkeypatch.setattr(
+        bot,
+        "start_report_generation_sync",
+        lambda c, u: calls.append(("report", c, u)),
+    )
+
+    bot.handle_message_sync("Отчет", "c1", "u1")
+    bot.handle_message_sync("помощь по отчет", "c1", "u1")
+
+    assert calls == [("report", "c1", "u1"), ("help", "c1", "u1")]
+
+
+@pytest.mark.parametrize(
+    "url, scheme, host, port",
+    [
+        ("https://mm.example.com", "https", "mm.example.com", 443),
+        ("http://mm.example.com:8065/", "http", "mm.example.com", 8065),
+        ("http://mm.example.com", "http", "mm.example.com", 80),
+        ("mm.example.com", "https", "mm.example.com", 443),
+    ],
+)
+def test_create_driver_takes_scheme_host_and_port_from_url(
+    monkeypatch, url, scheme, host, port
+):
+    captured = {}
+    monkeypatch.setattr(mattermost_bot.Config, "MATTERMOST_URL", url)
+    monkeypatch.setattr(
+        mattermost_bot, "Driver", lambda options: captured.update(options)
+    )
+
+    MattermostBot._create_driver(SimpleNamespace(_patch_driver_ssl=lambda driver: None))
+
+    assert (captured["scheme"], captured["url"], captured["port"]) == (
+        scheme,
+        host,
+        port,
+    )
+
+
+def test_channel_created_event_wakes_http_polling(bot):
+    bot._handle_channel_created_sync({"event": "channel_created", "data": {}})
+
+    assert bot._poll_wake.is_set()
+
+
+def test_project_selection_accepts_projects_keyword_in_any_case(bot, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        bot, "send_projects_list_sync", lambda c, u: calls.append((c, u))
+    )
+    session = UserSession(step="project_selection", channel_id="c1")
+
+    bot.handle_session_input_sync("Проекты", "c1", "u1", session)
+
+    assert calls == [("c1", "u1")]
+
+
+class FakeReportDriver(FakeDriver):
+    def __init__(self):
+        super().__init__()
+        self.files = self
+        self.uploads = []
+
+    def upload_file(self, channel_id, files):
+        filename, data, _ = files["files"]
+        self.uploads.append(
+            (filename, data if isinstance(data, bytes) else data.read())
+        )
+        return {"file_infos": [{"id": "file1"}]}
+
+
+def _worklog(date, hours, project="Project"):
+    return {
+        "date": date,
+        "executor": "john",
+        "hours": hours,
+        "hours_value": float(hours.replace(",", ".")),
+        "description": "PROJ-1 - Task",
+        "project_task": "Сопровождение Май",
+        "task_summary": "Task",
+        "project": project,
+        "project_key": "PROJ",
+    }
+
+
+def test_generate_report_uploads_workbook_with_summary(bot):
+    class FakeReportJira:
+        def get_worklogs_for_projects(self, project_keys, start_date, end_date):
+            assert project_keys == ["PROJ"]
+            return [
+                _worklog("2024-05-02 10:00", "1,5"),
+                _worklog("2024-05-01 09:00", "2"),
+            ]
+
+    bot.driver = FakeReportDriver()
+    bot._jira_clients["u1"] = (FakeReportJira(), mattermost_bot.time.monotonic())
+    session = UserSession(
+        channel_id="c1",
+        projects=[{"key": "PROJ", "name": "Project"}],
+        start_date="2024-05-01",
+        end_date="2024-05-31",
+    )
+
+    bot.generate_and_send_report_sync(session, "u1")
+
+    [(filename, data)] = bot.driver.uploads
+    assert filename.endswith(".xlsx")
+    sheet = load_workbook(BytesIO(data)).active
+    assert [row[0] for row in sheet.iter_rows(min_row=2, values_only=True)] == [
+        "01.05.2024 09:00:00",
+        "02.05.2024 10:00:00",
+    ]
+    # Итоги и подсказка по следующему отчету уходят одним постом вместе с файлом
+    [_status_post, file_post] = bot.driver.created_posts
+    assert file_post["file_ids"] == ["file1"]
+    assert "**Общее время:** 3.5 ч" in file_post["message"]
+    assert "Хотите создать новый отчёт?" in file_post["message"]
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2024-05-01", True),
+        (" 2024-5-1 ", True),
+        ("2024-02-30", False),
+        ("2024-13-01", False),
+        ("01.05.2024", False),
+        ("2024-05-01x", False),
+    ],
+)
+def test_validate_date(bot, value, expected):
+    assert bot._validate_date(value) is expected
+
+
+def test_dm_channel_welcome_is_sent_only_for_new_channel(bot):
+    class Channels:
+        def __init__(self, last_post_at):
+            self.last_post_at = last_post_at
+            self.requests = []
+
+        def create_direct_message_channel(self, user_ids):
+            self.requests.append(user_ids)
+            return {"id": "dm1", "type": "D", "last_post_at": self.last_post_at}
+
+    bot.driver.channels = Channels(last_post_at=0)
+    assert bot.create_or_get_dm_channel("u1") == "dm1"
+    assert bot.driver.channels.requests == [["bot", "u1"]]
+    assert len(bot.driver.created_posts) == 1
+
+    bot.driver.channels = Channels(last_post_at=1700000000000)
+    assert bot.create_or_get_dm_channel("u1") == "dm1"
+    assert len(bot.driver.created_posts) == 1
+
+
+def test_dm_access_is_cached_until_server_denies_access(bot):
+    class Channels:
+        def __init__(self):
+            self.members_requests = 0
+
+        def get_channel(self, channel_id):
+            return {"id": channel_id, "type": "D"}
+
+        def get_channel_members(self, channel_id):
+            self.members_requests += 1
+            return [{"user_id": "bot"}, {"user_id": "u1"}]
+
+    bot.driver.channels = Channels()
+    assert bot._ensure_dm_channel_access("u1", "dm1")
+    assert bot._ensure_dm_channel_access("u1", "dm1")
+    assert bot.driver.channels.members_requests == 1
+
+    def create_post(options):
+        raise NotEnoughPermissions("forbidden")
+
+    bot.driver.create_post = create_post
+    bot.send_message_sync("dm1", "hello")
+
+    assert bot._ensure_dm_channel_access("u1", "dm1")
+    assert bot.driver.channels.members_requests == 2
+
+
+def test_long_message_is_truncated_to_limit_with_notice(bot):
+    bot.send_message_sync("c1", "x" * (mattermost_bot.MESSAGE_MAX_LENGTH + 1))
+
+    message = bot.driver.created_posts[0]["message"]
+    assert len(message) == mattermost_bot.MESSAGE_MAX_LENGTH
+    assert message.endswith(mattermost_bot.TRUNCATION_NOTICE)
@@ -0,0 +1,362 @@
+import gc
+import json
+import weakref
+
+import pytest
+
+import user_auth
+from user_auth import UserAuthManager, UserSession
+
+
+@pytest.fixture(autouse=True)
+def cipher_cache(monkeypatch):
+    """Свой кэш шифров на каждый тест, как в отдельном процессе"""
+    monkeypatch.setattr(user_auth, "_CIPHER_CACHE", {})
+
+
+def test_sessions_survive_reload(tmp_path):
+    sessions_file = str(tmp_path / "sessions.json")
+    manager = UserAuthManager(sessions_file)
+    manager.save_user_credentials("u1", "john", "secret")
+    manager.update_user_session("u1", step="project_selection", channel_id="c1")
+    manager.flush()
+
+    reloaded = UserAuthManager(sessions_file)
+
+    assert reloaded.get_user_credentials("u1") == ("john", "secret")
+    assert reloaded.get_user_session("u1").step == "project_selection"
+    assert reloaded.get_user_session("u1").channel_id == "c1"
+    assert reloaded.get_authenticated_users_count() == 1
+
+
+def test_sessions_file_is_read_as_user_sessions(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    sessions_file.write_text(
+        json.dumps({"u1": {"step": "date_period", "projects": [{"key": "PROJ"}]}}),
+        encoding="utf-8",
+    )
+
+    manager = UserAuthManager(str(sessions_file))
+
+    assert manager.get_user_session("u1") == UserSession(
+        step="date_period", projects=[{"key": "PROJ"}]
+    )
+    assert manager.get_user_session("u2") is None
+    assert manager.is_user_authenticated("u1") is False
+
+
+def test_encryption_key_is_derived_once_and_cached_on_disk(tmp_path, monkeypatch):
+    sessions_file = str(tmp_path / "sessions.json")
+    manager = UserAuthManager(sessions_file)
+    manager.save_user_credentials("u1", "john", "secret")
+    manager.flush()
+
+    key_file = tmp_path / "sessions.json.key"
+    assert key_file.stat().st_mode & 0o777 == 0o600
+
+    def fail_derive(*args, **kwargs):
+        raise AssertionError("ключ должен браться из файла")
+
+    monkeypatch.setattr(user_auth, "PBKDF2HMAC", fail_derive)
+    # Как после перезапуска: кэша шифров в процессе еще нет
+    monkeypatch.setattr(user_auth, "_CIPHER_CACHE", {})
+    reloaded = UserAuthManager(sessions_file)
+
+    assert reloaded.get_user_credentials("u1") == ("john", "secret")
+
+
+def test_cipher_is_shared_between_managers(tmp_path):
+    first = UserAuthManager(str(tmp_path / "first.json"))
+    second = UserAuthManager(str(tmp_path / "second.json"))
+
+    assert first._encryption_key is second._encryption_key
+
+
+def test_credentials_saved_with_fernet_are_still_readable(tmp_path):
+    sessions_file = str(tmp_path / "sessions.json")
+    manager = UserAuthManager(sessions_file)
+    fernet = manager._encryption_key
+    manager.update_user_session(
+        "u1",
+        jira_username=fernet.encrypt(b"john").decode(),
+        jira_password=fernet.encrypt(b"secret").decode(),
+        authenticated=True,
+    )
+
+    assert manager.get_user_credentials("u1") == ("john", "secret")
+
+    manager.save_user_credentials("u1", "john", "secret")
+    assert manager.get_user_session("u1").jira_password.startswith("gcm1:")
+    manager.flush()
+    assert UserAuthManager(sessions_file).get_user_credentials("u1") == (
+        "john",
+        "secret",
+    )
+
+
+def test_key_is_not_derived_for_session_only_operations(tmp_path, monkeypatch):
+    def fail_generate(self):
+        raise AssertionError("ключ не нужен для работы с сессией")
+
+    monkeypatch.setattr(UserAuthManager, "_generate_key", fail_generate)
+    manager = UserAuthManager(str(tmp_path / "sessions.json"))
+    manager.update_user_session("u1", step="project_selection")
+
+    assert manager.get_user_session("u1").step == "project_selection"
+    assert manager.get_authenticated_users_count() == 0
+
+
+def test_session_changes_are_written_in_one_deferred_save(tmp_path, monkeypatch):
+    manager = UserAuthManager(str(tmp_path / "sessions.json"))
+    writes = []
+    monkeypatch.setattr(
+        manager, "_append_journal", lambda pending: writes.append(pending) or True
+    )
+
+    manager.update_user_session("u1", step="project_selection")
+    manager.update_user_session("u1", channel_id="c1")
+    manager.update_user_session("u2", step="date_period")
+    assert writes == []
+
+    manager.flush()
+    manager.flush()
+    assert writes == [
+        {
+            "u1": {"step": "project_selection", "channel_id": "c1"},
+            "u2": {"step": "date_period"},
+        }
+    ]
+
+
+def test_authenticated_users_count_follows_credentials(tmp_path):
+    manager = UserAuthManager(str(tmp_path / "sessions.json"))
+
+    manager.save_user_credentials("u1", "john", "secret")
+    manager.save_user_credentials("u1", "john", "new-secret")
+    manager.save_user_credentials("u2", "jane", "secret")
+    assert manager.get_authenticated_users_count() == 2
+
+    manager.remove_user_credentials("u1")
+    manager.remove_user_credentials("u1")
+    manager.remove_user_credentials("missing")
+    assert manager.get_authenticated_users_count() == 1
+
+
+def test_session_changes_are_appended_to_journal_and_replayed(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    journal_file = tmp_path / "sessions.json.log"
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", step="project_selection", channel_id="c1")
+    manager.flush()
+    # Первая запись - полный снимок, журнал еще пуст
+    snapshot = sessions_file.read_bytes()
+    assert not journal_file.exists()
+
+    manager.update_user_session("u1", step="date_period")
+    manager.flush()
+
+    assert sessions_file.read_bytes() == snapshot
+    assert len(journal_file.read_bytes().splitlines()) == 1
+    reloaded = UserAuthManager(str(sessions_file))
+    assert reloaded.get_user_session("u1") == UserSession(
+        channel_id="c1", step="date_period"
+    )
+
+
+def test_journal_is_compacted_into_snapshot(tmp_path, monkeypatch):
+    sessions_file = tmp_path / "sessions.json"
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+
+    monkeypatch.setattr(UserAuthManager, "JOURNAL_COMPACT_RATIO", 0)
+    manager.update_user_session("u1", step="date_period")
+    manager.flush()
+
+    assert not (tmp_path / "sessions.json.log").exists()
+    assert UserAuthManager(str(sessions_file)).get_user_session("u1").step == (
+        "date_period"
+    )
+
+
+def test_bulk_credentials_are_saved_in_one_write(tmp_path, monkeypatch):
+    sessions_file = str(tmp_path / "sessions.json")
+    manager = UserAuthManager(sessions_file)
+    writes = []
+    original_compact = manager._compact
+    monkeypatch.setattr(
+        manager, "_compact", lambda: writes.append(True) or original_compact()
+    )
+
+    manager.save_user_credentials_bulk(
+        [("u1", "john", "secret"), ("u2", "jane", "password")]
+    )
+    manager.flush()
+
+    assert writes == [True]
+    reloaded = UserAuthManager(sessions_file)
+    assert reloaded.get_user_credentials("u1") == ("john", "secret")
+    assert reloaded.get_user_credentials("u2") == ("jane", "password")
+    assert reloaded.get_authenticated_users_count() == 2
+
+
+def test_sessions_directory_is_created_on_init(tmp_path):
+    sessions_file = tmp_path / "state" / "sessions.json"
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+
+    assert sessions_file.exists()
+
+
+def test_snapshot_replaces_target_of_symlinked_sessions_file(tmp_path):
+    state_file = tmp_path / "state.json"
+    state_file.write_text("{}", encoding="utf-8")
+    sessions_link = tmp_path / "sessions.json"
+    sessions_link.symlink_to(state_file)
+
+    manager = UserAuthManager(str(sessions_link))
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+
+    assert sessions_link.is_symlink()
+    assert json.loads(state_file.read_text(encoding="utf-8"))["u1"]["step"] == (
+        "project_selection"
+    )
+    assert not (tmp_path / "state.json.tmp").exists()
+
+
+def test_unknown_session_fields_are_kept_and_defaults_are_not_written(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    sessions_file.write_text(
+        json.dumps({"u1": {"step": "date_period", "locale": "ru"}}),
+        encoding="utf-8",
+    )
+
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", channel_id="c1", theme="dark")
+    manager.flush()
+    # Полный снимок пишется при сворачивании журнала
+    manager._compact()
+
+    assert manager.get_user_session("u1").extra == {"locale": "ru", "theme": "dark"}
+    assert json.loads(sessions_file.read_text(encoding="utf-8")) == {
+        "u1": {
+            "channel_id": "c1",
+            "step": "date_period",
+            "locale": "ru",
+            "theme": "dark",
+        }
+    }
+
+
+def test_unchanged_session_values_are_not_saved(tmp_path, monkeypatch):
+    manager = UserAuthManager(str(tmp_path / "sessions.json"))
+    manager.update_user_session("u1", step="project_selection", channel_id="c1")
+    manager.flush()
+    saves = []
+    monkeypatch.setattr(manager, "_save_sessions", lambda *args: saves.append(args))
+
+    manager.update_user_session("u1", step="project_selection")
+    manager.update_user_session("u1", step="project_selection", channel_id="c2")
+
+    assert saves == [("u1", {"channel_id": "c2"})]
+
+
+def test_unchanged_snapshot_is_not_rewritten(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+    sessions_file.write_bytes(b"{}")
+
+    # Снимок в памяти совпадает с последним записанным - запись пропускается
+    assert manager._write_sessions() is True
+    assert sessions_file.read_bytes() == b"{}"
+
+
+def test_corrupted_cached_key_is_derived_again(tmp_path, monkeypatch):
+    sessions_file = str(tmp_path / "sessions.json")
+    manager = UserAuthManager(sessions_file)
+    manager.save_user_credentials("u1", "john", "secret")
+    manager.flush()
+
+    key_file = tmp_path / "sessions.json.key"
+    fingerprint, key = key_file.read_bytes().split(b"\n")[:2]
+    key_file.write_bytes(fingerprint + b"\n" + key[:10] + b"\n")
+    monkeypatch.setattr(user_auth, "_CIPHER_CACHE", {})
+
+    reloaded = UserAuthManager(sessions_file)
+
+    assert reloaded.get_user_credentials("u1") == ("john", "secret")
+    assert key_file.read_bytes().split(b"\n")[1] == key
+
+
+def test_journal_lines_of_wrong_shape_are_skipped(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    (tmp_path / "sessions.json.log").write_text(
+        "[]\n"
+        '{"u": "u1"}\n'
+        '{"u": "u1", "p": []}\n'
+        '{"u": 1, "p": {"step": "date_period"}}\n'
+        '{"u": "u1", "p": {"step": "project_selection"}}\n'
+        '{"u": "u1", "p": {"step": "dat',
+        encoding="utf-8",
+    )
+
+    manager = UserAuthManager(str(sessions_file))
+
+    assert manager.get_user_session("u1") == UserSession(step="project_selection")
+
+
+def test_journal_is_truncated_when_it_cannot_be_removed(tmp_path, monkeypatch):
+    sessions_file = tmp_path / "sessions.json"
+    journal_file = tmp_path / "sessions.json.log"
+    manager = UserAuthManager(str(sessions_file))
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+    manager.update_user_session("u1", step="date_period")
+    manager.flush()
+    assert journal_file.read_bytes()
+
+    def fail_remove(path):
+        raise PermissionError("remove denied")
+
+    monkeypatch.setattr(user_auth.os, "remove", fail_remove)
+    # Дописать журнал не удалось - изменения попадают только в снимок
+    monkeypatch.setattr(manager, "_append_journal", lambda pending: False)
+    manager.update_user_session("u1", step="project_selection")
+    manager.flush()
+
+    assert journal_file.read_bytes() == b""
+    assert UserAuthManager(str(sessions_file)).get_user_session("u1").step == (
+        "project_selection"
+    )
+
+
+def test_manager_is_not_kept_alive_by_exit_hook(tmp_path):
+    manager = UserAuthManager(str(tmp_path / "sessions.json"))
+    manager_ref = weakref.ref(manager)
+
+    del manager
+    gc.collect()
+
+    assert manager_ref() is None
+
+
+def test_save_after_torn_journal_tail_survives_reload(tmp_path):
+    sessions_file = tmp_path / "sessions.json"
+    journal_file = tmp_path / "sessions.json.log"
+    # Снимок достаточно велик, чтобы новая запись дописывалась в журнал
+    sessions_file.write_text(
+        json.dumps({"u1": {"step": "a", "projects": [{"key": "P"}] * 20}}),
+        encoding="utf-8",
+    )
+    journal_file.write_bytes(b'{"u":"u1","p":{"step":"b"}}\n{"u":"u1","p":{"step":"c')
+
+    manager = UserAuthManager(str(sessions_file))
+    assert manager.get_user_session("u1").step == "b"
+    manager.update_user_session("u1", step="d")
+    manager.flush()
+
+    assert UserAuthManager(str(sessions_file)).get_user_session("u1").step == "d"
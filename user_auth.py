@@ -1,115 +1,540 @@
+import atexit
 import json
 import os
 import base64
+import hashlib
+from dataclasses import dataclass, fields
+from functools import cached_property
+from typing import Any, Dict, List, Optional, Tuple
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 import logging
+import sys
+import threading
+import weakref
+
+try:
+    # orjson сериализует и разбирает файл сессий в несколько раз быстрее json
+    import orjson
+
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:  # orjson не установлен - используем стандартный json
+    _loads = json.loads
+
+    def _dumps(obj) -> bytes:
+        # Без пробелов-разделителей, как и orjson; кириллица (названия
+        # проектов) пишется как есть - это короче, чем escape-последовательности
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
 
 logger = logging.getLogger(__name__)
 
+# Параметры вывода ключа шифрования учетных данных из BOT_NAME.
+# Это ключ для шифрования данных в файле сессий, а не хэш пароля: вход не
+# секретен, поэтому итерации здесь не добавляют стойкости. Но менять соль
+# или число итераций нельзя - ключ изменится, и сохраненные учетные данные
+# перестанут расшифровываться. Стоимость вывода снимает кэш ключа на диске
+_KDF_SALT = b"stable_salt_for_consistency"  # В продакшене должна быть уникальная соль
+_KDF_ITERATIONS = 100000
+
+# Префикс значений, зашифрованных AES-256-GCM; значения без него - Fernet
+_AEAD_PREFIX = "gcm1:"
+_AEAD_NONCE_SIZE = 12
+
+# Шифры по отпечатку входных данных ключа: общие для всех менеджеров
+# в процессе, чтобы ключ не читался и не выводился повторно
+_CIPHER_CACHE: Dict[str, Tuple[Fernet, AESGCM]] = {}
+_CIPHER_LOCK = threading.Lock()
+
+
+@dataclass(slots=True)
+class UserSession:
+    """Сессия пользователя: учетные данные Jira и состояние диалога с ботом"""
+
+    # Зашифрованные учетные данные Jira
+    jira_username: Optional[str] = None
+    jira_password: Optional[str] = None
+    authenticated: bool = False
+    # Состояние диалога
+    channel_id: Optional[str] = None
+    step: Optional[str] = None
+    temp_username: Optional[str] = None
+    projects: Optional[List[dict]] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    # Поля, которых нет среди известных; словарь создается только при
+    # появлении такого поля и сохраняется в файл наравне с остальными
+    extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserSession":
+        """Создание сессии из словаря, сохраненного в файле сессий"""
+        session = cls()
+        session.update(data)
+        return session
+
+    def to_dict(self) -> dict:
+        """Словарь для сохранения в файл сессий.
+
+        Поля со значением по умолчанию не записываются: from_dict их
+        восстановит, а файл и журнал становятся компактнее.
+        """
+        data = {}
+        for name in _SESSION_FIELDS:
+            value = getattr(self, name)
+            if value is not None and value is not False:
+                data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def diff(self, changes: dict) -> dict:
+        """Только те изменения, которые отличаются от текущих значений полей"""
+        extra = self.extra or {}
+        return {
+            key: value
+            for key, value in changes.items()
+            if (
+                getattr(self, key)
+                if key in _SESSION_FIELDS
+                else extra.get(key, _MISSING)
+            )
+            != value
+        }
+
+    def update(self, changes: dict):
+        """Применение изменений полей; неизвестные поля попадают в extra"""
+        for key, value in changes.items():
+            if key in _SESSION_FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+
+# Отсутствующее значение поля из extra (отличается от любого значения, даже None)
+_MISSING = object()
+
+# Поля сессии, которые хранятся в файле как есть (extra разворачивается)
+_SESSION_FIELDS = tuple(f.name for f in fields(UserSession) if f.name != "extra")
+
+
+def _flush_at_exit(flush_ref: weakref.WeakMethod):
+    """Запись отложенных изменений сессий при выходе, если менеджер еще жив"""
+    flush = flush_ref()
+    if flush is not None:
+        flush()
+
 
 class UserAuthManager:
     """Управление индивидуальными учетными данными пользователей для Jira"""
 
+    # Суффикс файла рядом с файлом сессий, где хранится выведенный ключ
+    KEY_FILE_SUFFIX = ".key"
+    # Суффикс журнала изменений сессий, дописываемого после полного снимка
+    JOURNAL_FILE_SUFFIX = ".log"
+    # Журнал сворачивается в снимок, когда становится во столько раз больше него
+    JOURNAL_COMPACT_RATIO = 10
+
+    # Задержка записи файла сессий (сек): изменения за это время, например
+    # несколько обновлений сессии подряд, сохраняются одной записью
+    SAVE_DELAY = 0.2
+
     def __init__(self, sessions_file="user_sessions.json"):
         self.sessions_file = sessions_file
         self._sessions = {}
+        # Защищает сессии от записи в файл во время их изменения
+        self._lock = threading.RLock()
+        self._save_timer: Optional[threading.Timer] = None
+        # Изменения полей по пользователям, еще не записанные в журнал
+        self._pending: Dict[str, dict] = {}
+
+        # Каталог для файла сессий создается один раз, а не при каждой записи
+        sessions_dir = os.path.dirname(sessions_file)
+        if sessions_dir:
+            try:
+                os.makedirs(sessions_dir, exist_ok=True)
+            except OSError as e:
+                logger.error(f"Ошибка создания каталога сессий: {e}")
+
         self._load_sessions()
+        # Отложенные изменения не должны теряться при завершении процесса
+        # Слабая ссылка: регистрация не должна держать менеджер в памяти
+        atexit.register(_flush_at_exit, weakref.WeakMethod(self.flush))
+
+    # Ключ шифрования генерируется на основе BOT_NAME (в реальном проекте
+    # лучше использовать отдельный SECRET_KEY) при первом шифровании или
+    # расшифровке: сессии и счетчики пользователей в нем не нуждаются
+    @cached_property
+    def _encryption_key(self) -> Fernet:
+        """Fernet - только для расшифровки ранее сохраненных значений"""
+        return self._generate_key()[0]
 
-        # Генерируем ключ шифрования на основе BOT_NAME (в реальном проекте лучше использовать отдельный SECRET_KEY)
-        self._encryption_key = self._generate_key()
+    @cached_property
+    def _aead(self) -> AESGCM:
+        """AES-256-GCM для шифрования учетных данных"""
+        return self._generate_key()[1]
 
     def _generate_key(self):
         """Генерация ключа шифрования"""
         # В реальном проекте лучше использовать отдельную переменную SECRET_KEY
         password = os.getenv("BOT_NAME", "jira-timesheet-bot").encode()
-        salt = (
-            b"stable_salt_for_consistency"  # В продакшене должна быть уникальная соль
-        )
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return Fernet(key)
 
-    def _encrypt_data(self, data):
+        # PBKDF2 - самая дорогая часть запуска, а его вход постоянен. Поэтому
+        # ключ выводится один раз и сохраняется рядом с файлом сессий вместе
+        # с отпечатком входных данных
+        fingerprint = hashlib.sha256(
+            password + _KDF_SALT + str(_KDF_ITERATIONS).encode()
+        ).hexdigest()
+        with _CIPHER_LOCK:
+            cipher = _CIPHER_CACHE.get(fingerprint)
+            if cipher is None:
+                key = self._read_cached_key(fingerprint)
+                if key is None:
+                    kdf = PBKDF2HMAC(
+                        algorithm=hashes.SHA256(),
+                        length=32,
+                        salt=_KDF_SALT,
+                        iterations=_KDF_ITERATIONS,
+                    )
+                    key = base64.urlsafe_b64encode(kdf.derive(password))
+                    self._write_cached_key(fingerprint, key)
+                # Для AES-GCM берется отдельный подключ, чтобы один и тот же
+                # ключ не использовался двумя разными шифрами
+                aead_key = HKDF(
+                    algorithm=hashes.SHA256(),
+                    length=32,
+                    salt=None,
+                    info=b"user-sessions-aes-256-gcm",
+                ).derive(base64.urlsafe_b64decode(key))
+                cipher = (Fernet(key), AESGCM(aead_key))
+                _CIPHER_CACHE[fingerprint] = cipher
+        return cipher
+
+    def _key_file(self) -> str:
+        """Путь к файлу ключа рядом с реальным файлом сессий (не симлинком)"""
+        return os.path.realpath(self.sessions_file) + self.KEY_FILE_SUFFIX
+
+    def _read_cached_key(self, fingerprint: str) -> Optional[bytes]:
+        """Ключ из файла, если он выведен из тех же данных, иначе None"""
+        try:
+            with open(self._key_file(), "rb") as f:
+                cached_fingerprint, key = f.read().split(b"\n")[:2]
+        except (OSError, ValueError):
+            return None
+        if cached_fingerprint.decode(errors="replace") != fingerprint:
+            return None
+        # Обрезанный или испорченный ключ не используем: он будет выведен
+        # заново и перезаписан
+        try:
+            raw_key = base64.b64decode(key, altchars=b"-_", validate=True)
+        except ValueError:
+            return None
+        if len(raw_key) != 32:
+            return None
+        return key
+
+    def _write_cached_key(self, fingerprint: str, key: bytes):
+        """Атомарная запись ключа в файл, доступный только владельцу"""
+        key_file = self._key_file()
+        tmp_file = f"{key_file}.{os.getpid()}.tmp"
+        try:
+            fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(fingerprint.encode() + b"\n" + key + b"\n")
+            os.replace(tmp_file, key_file)
+        except OSError as e:
+            # Без файла ключ просто будет выведен заново при следующем запуске
+            logger.warning(f"Не удалось сохранить ключ шифрования: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+    def _encrypt_data(self, data: bytes) -> str:
         """Шифрование данных"""
-        if isinstance(data, str):
-            data = data.encode()
-        return self._encryption_key.encrypt(data).decode()
+        nonce = os.urandom(_AEAD_NONCE_SIZE)
+        encrypted = self._aead.encrypt(nonce, data, None)
+        return _AEAD_PREFIX + base64.urlsafe_b64encode(nonce + encrypted).decode()
 
     def _decrypt_data(self, encrypted_data):
-        """Расшифровка данных"""
-        return self._encryption_key.decrypt(encrypted_data.encode()).decode()
+        """Расшифровка данных (AES-GCM или Fernet для старых сессий)"""
+        if not encrypted_data.startswith(_AEAD_PREFIX):
+            return self._encryption_key.decrypt(encrypted_data.encode()).decode()
+
+        # Один разбор base64; nonce и шифротекст - срезы без копирования
+        raw = memoryview(base64.urlsafe_b64decode(encrypted_data[len(_AEAD_PREFIX) :]))
+        nonce, encrypted = raw[:_AEAD_NONCE_SIZE], raw[_AEAD_NONCE_SIZE:]
+        return self._aead.decrypt(nonce, encrypted, None).decode()
 
     def _load_sessions(self):
         """Загрузка сессий пользователей"""
-        if os.path.exists(self.sessions_file):
+        self._sessions = {}
+        self._snapshot_size = 0
+        # hash() содержимого последнего записанного снимка
+        self._snapshot_hash: Optional[int] = None
+        try:
+            with open(self.sessions_file, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        except OSError as e:
+            logger.error(f"Ошибка загрузки сессий: {e}")
+            data = None
+
+        if data is not None:
             try:
-                with open(self.sessions_file, "r", encoding="utf-8") as f:
-                    self._sessions = json.load(f)
+                self._sessions = {
+                    sys.intern(user_id): UserSession.from_dict(session)
+                    for user_id, session in _loads(data).items()
+                }
+                self._snapshot_size = len(data)
+                self._snapshot_hash = hash(data)
                 logger.info(f"Загружено {len(self._sessions)} пользовательских сессий")
             except Exception as e:
                 logger.error(f"Ошибка загрузки сессий: {e}")
                 self._sessions = {}
-        else:
-            self._sessions = {}
+        journal_damaged = self._replay_journal()
+
+        # Дальше счетчик меняется только через _set_authenticated
+        self._auth_count = sum(
+            1 for session in self._sessions.values() if session.authenticated
+        )
+
+        # Поврежденный журнал сразу заменяем снимком, чтобы новые записи
+        # дописывались в чистый файл
+        if journal_damaged:
+            self._compact()
+
+    def _user_session(self, user_id: str) -> UserSession:
+        """Сессия пользователя для изменения; создается, если ее еще нет.
+
+        ID пользователя в ключе интернируется: каждое сообщение приносит новую
+        строку с тем же ID, а ключ хранится в одном экземпляре.
+        """
+        user_session = self._sessions.get(user_id)
+        if user_session is None:
+            user_session = self._sessions[sys.intern(user_id)] = UserSession()
+        return user_session
+
+    def _set_authenticated(self, user_session: UserSession, authenticated: bool):
+        """Изменение флага authenticated с поддержкой счетчика пользователей"""
+        if user_session.authenticated != authenticated:
+            self._auth_count += 1 if authenticated else -1
+            user_session.authenticated = authenticated
+
+    def _journal_file(self) -> str:
+        """Путь к журналу рядом с реальным файлом сессий (не симлинком)"""
+        return os.path.realpath(self.sessions_file) + self.JOURNAL_FILE_SUFFIX
+
+    def _replay_journal(self) -> bool:
+        """Применение к загруженному снимку изменений из журнала.
+
+        Возвращает True, если журнал поврежден (пропущены строки или последняя
+        строка не дописана) и его нужно свернуть в снимок.
+        """
+        try:
+            with open(self._journal_file(), "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            self._journal_size = 0
+            return False
+        except OSError as e:
+            logger.error(f"Ошибка чтения журнала сессий: {e}")
+            self._journal_size = 0
+            return False
+
+        self._journal_size = len(journal)
+        # Без завершающего перевода строки следующая запись склеилась бы с
+        # недописанной строкой и потерялась при следующей загрузке
+        damaged = bool(journal) and not journal.endswith(b"\n")
+        for line in journal.splitlines():
+            try:
+                entry = _loads(line)
+                user_id, changes = entry["u"], entry["p"]
+                if not isinstance(user_id, str) or not isinstance(changes, dict):
+                    raise TypeError("неверный формат записи")
+            except (ValueError, KeyError, TypeError):
+                # Строка, не дописанная из-за сбоя при записи, или чужой формат
+                logger.warning("Пропущена поврежденная запись журнала сессий")
+                damaged = True
+                continue
+            self._user_session(user_id).update(changes)
+        return damaged
+
+    def _save_sessions(self, user_id: str, changes: dict):
+        """Запоминание изменений сессии и планирование записи через SAVE_DELAY секунд"""
+        with self._lock:
+            self._pending.setdefault(user_id, {}).update(changes)
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(self.SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Немедленная запись запланированных изменений сессий в файл"""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            pending, self._pending = self._pending, {}
+
+            # Обычно дописываются только изменения; полный снимок пишется,
+            # когда журнал разросся или дописать его не удалось
+            if (
+                not self._append_journal(pending)
+                or self._journal_size > self.JOURNAL_COMPACT_RATIO * self._snapshot_size
+            ):
+                self._compact()
+
+    def _append_journal(self, pending: Dict[str, dict]) -> bool:
+        """Дописывание изменений сессий в журнал, по строке на пользователя"""
+        try:
+            data = b"".join(
+                _dumps({"u": user_id, "p": changes}) + b"\n"
+                for user_id, changes in pending.items()
+            )
+            with open(self._journal_file(), "ab") as f:
+                f.write(data)
+            self._journal_size += len(data)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала сессий: {e}")
+            return False
 
-    def _save_sessions(self):
-        """Сохранение сессий пользователей"""
+    def _compact(self):
+        """Запись полного снимка сессий и удаление журнала"""
+        if not self._write_sessions():
+            return
+        # Журнал после снимка должен исчезнуть или опустеть: в нем могут быть
+        # более старые значения тех же полей (например, если снимок пишется
+        # после неудачного дописывания), и при загрузке они перекрыли бы снимок
+        journal_file = self._journal_file()
         try:
-            os.makedirs(
-                (
-                    os.path.dirname(self.sessions_file)
-                    if os.path.dirname(self.sessions_file)
-                    else "."
-                ),
-                exist_ok=True,
+            os.remove(journal_file)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Не удалось удалить журнал сессий, очищаем его: {e}")
+            try:
+                with open(journal_file, "wb"):
+                    pass
+            except OSError as e:
+                logger.error(f"Ошибка очистки журнала сессий: {e}")
+                return
+        self._journal_size = 0
+
+    def _write_sessions(self) -> bool:
+        """Сохранение снимка сессий пользователей"""
+        try:
+            # Файл не редактируется вручную, поэтому пишется без отступов
+            data = _dumps(
+                {
+                    user_id: session.to_dict()
+                    for user_id, session in self._sessions.items()
+                }
             )
-            with open(self.sessions_file, "w", encoding="utf-8") as f:
-                json.dump(self._sessions, f, ensure_ascii=False, indent=2)
-            logger.debug("Сессии пользователей сохранены")
         except Exception as e:
             logger.error(f"Ошибка сохранения сессий: {e}")
+            return False
+
+        # Снимок не изменился с последней записи (например, журнал содержал
+        # только уже записанные значения) - файл не трогаем
+        data_hash = hash(data)
+        if data_hash == self._snapshot_hash:
+            return True
+
+        # Снимок пишется во временный файл и атомарно подменяет старый, чтобы
+        # сбой посреди записи не оставил обрезанный файл. Подменяется файл по
+        # реальному пути: в Docker файл сессий - симлинк в /app/state
+        sessions_path = os.path.realpath(self.sessions_file)
+        tmp_file = sessions_path + ".tmp"
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, sessions_path)
+        except OSError as e:
+            logger.error(f"Ошибка сохранения сессий: {e}")
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            return False
+
+        self._snapshot_size = len(data)
+        self._snapshot_hash = data_hash
+        logger.debug("Сессии пользователей сохранены")
+        return True
 
     def is_user_authenticated(self, user_id):
         """Проверка, аутентифицирован ли пользователь в Jira"""
-        user_session = self._sessions.get(user_id, {})
-        return bool(
-            user_session.get("jira_username") and user_session.get("jira_password")
-        )
+        # Флаг authenticated выставляется вместе с учетными данными
+        # (save_user_credentials) и сбрасывается при их удалении
+        user_session = self._sessions.get(user_id)
+        return user_session is not None and user_session.authenticated
 
     def save_user_credentials(self, user_id, username, password):
         """Сохранение учетных данных пользователя"""
-        if user_id not in self._sessions:
-            self._sessions[user_id] = {}
-
-        # Шифруем чувствительные данные
-        self._sessions[user_id].update(
-            {
-                "jira_username": self._encrypt_data(username),
-                "jira_password": self._encrypt_data(password),
-                "authenticated": True,
-            }
+        self._store_credentials([(user_id, username, password)])
+        logger.info(f"Учетные данные Jira сохранены для пользователя {user_id}")
+
+    def save_user_credentials_bulk(self, credentials: List[Tuple[str, str, str]]):
+        """Сохранение учетных данных сразу многих пользователей
+
+        credentials - список (user_id, username, password). Все изменения
+        попадают в одну запись файла сессий.
+        """
+        self._store_credentials(credentials)
+        logger.info(
+            f"Учетные данные Jira сохранены для {len(credentials)} пользователей"
         )
 
-        self._save_sessions()
-        logger.info(f"Учетные данные Jira сохранены для пользователя {user_id}")
+    def _store_credentials(self, credentials: List[Tuple[str, str, str]]):
+        """Шифрование и сохранение учетных данных под одной блокировкой"""
+        # Шифруем чувствительные данные до блокировки
+        encrypted = [
+            (
+                user_id,
+                self._encrypt_data(username.encode()),
+                self._encrypt_data(password.encode()),
+            )
+            for user_id, username, password in credentials
+        ]
+
+        with self._lock:
+            for user_id, encrypted_username, encrypted_password in encrypted:
+                user_session = self._user_session(user_id)
+                user_session.jira_username = encrypted_username
+                user_session.jira_password = encrypted_password
+                self._set_authenticated(user_session, True)
+                self._save_sessions(
+                    user_id,
+                    {
+                        "jira_username": encrypted_username,
+                        "jira_password": encrypted_password,
+                        "authenticated": True,
+                    },
+                )
 
     def get_user_credentials(self, user_id):
         """Получение учетных данных пользователя"""
-        user_session = self._sessions.get(user_id, {})
-
         if not self.is_user_authenticated(user_id):
             return None, None
 
+        user_session = self._sessions[user_id]
         try:
-            username = self._decrypt_data(user_session["jira_username"])
-            password = self._decrypt_data(user_session["jira_password"])
+            username = self._decrypt_data(user_session.jira_username)
+            password = self._decrypt_data(user_session.jira_password)
             return username, password
         except Exception as e:
             logger.error(
@@ -119,29 +544,40 @@ class UserAuthManager:
 
     def remove_user_credentials(self, user_id):
         """Удаление учетных данных пользователя"""
-        if user_id in self._sessions:
-            self._sessions[user_id].pop("jira_username", None)
-            self._sessions[user_id].pop("jira_password", None)
-            self._sessions[user_id]["authenticated"] = False
-            self._save_sessions()
-            logger.info(f"Учетные данные Jira удалены для пользователя {user_id}")
+        with self._lock:
+            user_session = self._sessions.get(user_id)
+            if user_session is None:
+                return
+            user_session.jira_username = None
+            user_session.jira_password = None
+            self._set_authenticated(user_session, False)
+            self._save_sessions(
+                user_id,
+                {"jira_username": None, "jira_password": None, "authenticated": False},
+            )
+        logger.info(f"Учетные данные Jira удалены для пользователя {user_id}")
 
-    def get_user_session(self, user_id):
-        """Получение сессии пользователя"""
-        return self._sessions.get(user_id, {})
+    def get_user_session(self, user_id) -> Optional[UserSession]:
+        """Получение сессии пользователя (None, если сессии нет)"""
+        return self._sessions.get(user_id)
 
     def update_user_session(self, user_id, **kwargs):
-        """Обновление сессии пользователя"""
-        if user_id not in self._sessions:
-            self._sessions[user_id] = {}
-
-        self._sessions[user_id].update(kwargs)
-        self._save_sessions()
+        """Обновление полей сессии пользователя"""
+        with self._lock:
+            user_session = self._user_session(user_id)
+            if "authenticated" in kwargs:
+                kwargs["authenticated"] = bool(kwargs["authenticated"])
+            # Повторная установка тех же значений (например, текущего шага
+            # диалога) не должна приводить к записи
+            changes = user_session.diff(kwargs)
+            if not changes:
+                return
+            patch = dict(changes)
+            if "authenticated" in changes:
+                self._set_authenticated(user_session, changes.pop("authenticated"))
+            user_session.update(changes)
+            self._save_sessions(user_id, patch)
 
     def get_authenticated_users_count(self):
         """Получение количества аутентифицированных пользователей"""
-        return sum(
-            1
-            for session in self._sessions.values()
-            if session.get("authenticated", False)
-        )
+        return self._auth_count